@@ -0,0 +1,171 @@
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import balls
+
+# Ограничение длины одного прогона (тики)
+DEFAULT_MAX_TICKS = 60 * 60 * 10
+
+# Столбцы итоговой таблицы после параметров
+METRIC_COLUMNS = ("seed", "ticks", "waves", "kills", "ttk_s", "peak_balls", "score", "health", "wall_s")
+
+# Скриптовый игрок: целится в ближайшего врага и стреляет каждые fire_every тиков
+class AimBot:
+    def __init__(self, fire_every=10):
+        self.fire_every = fire_every
+        self.viewport = balls.DEFAULT_VIEWPORT
+    
+    def next_input(self, sim):
+        player = sim.player
+        enemies = sim.enemies
+        if not enemies:
+            return balls.IDLE_INPUT
+        
+        p = player.position
+        offset = enemies.positions[:enemies.count] - p.as_tuple()
+        nearest = np.argmin(offset[:, 0] * offset[:, 0] + offset[:, 1] * offset[:, 1] + offset[:, 2] * offset[:, 2])
+        dx, dy, dz = offset[nearest].tolist()
+        
+        # Смещение мыши, которое повернёт камеру на цель
+        yaw = math.atan2(dx, -dz)
+        pitch = math.atan2(dy, math.hypot(dx, dz))
+        turn = (yaw - player.yaw + math.pi) % (2 * math.pi) - math.pi
+        mouse_dx = round(turn / balls.MOUSE_SENSITIVITY)
+        mouse_dy = round((pitch - player.pitch) / balls.MOUSE_SENSITIVITY)
+        
+        buttons = 0
+        if sim.tick % self.fire_every == 0:
+            buttons = balls.INPUT_FIRE | balls.INPUT_DEFLECT
+        return balls.TickInput(buttons, mouse_dx, mouse_dy)
+
+# Записанный игрок: ввод из файла записи, после конца записи - бездействие; экран - тот, что в записи
+class RecordedPlayer:
+    def __init__(self, path):
+        _, _, self.viewport, ticks = balls.load_recording(path)
+        self.inputs = [balls.TickInput(*tick) for tick in ticks.tolist()]
+        self.position = 0
+    
+    def next_input(self, sim):
+        if self.position >= len(self.inputs):
+            return balls.IDLE_INPUT
+        inputs = self.inputs[self.position]
+        self.position += 1
+        return inputs
+
+def make_policy(spec):
+    if spec.startswith("aim"):
+        _, _, fire_every = spec.partition(":")
+        return AimBot(int(fire_every or 10))
+    return RecordedPlayer(spec)
+
+# Один прогон: параметры баланса, зерно и политика игрока -> метрики.
+# С контрольной точкой прогон начинается с неё: баланс - её, с заменой заданных параметров, генератор - от зерна прогона
+def run_one(job):
+    params, seed, policy_spec, max_ticks, state_path = job
+    sim = balls.Simulation(seed, balls.DEFAULT_BALANCE._replace(**params))
+    if state_path:
+        sim.restore_state(balls.load_state(state_path))
+        sim.balance = sim.balance._replace(**params)
+        sim.rng.seed(seed)
+    policy = make_policy(policy_spec)
+    sim.viewport = policy.viewport
+    
+    # Метрики - только за этот прогон: то, что накоплено до контрольной точки, вычитается
+    start_tick, start_wave, start_kills, start_kill_ticks, start_score = (
+        sim.tick, sim.wave, sim.kills, sim.kill_ticks, sim.player.score)
+    
+    peak_balls = 0
+    start = time.perf_counter()
+    end_tick = sim.tick + max_ticks
+    while sim.tick < end_tick and not sim.game_over:
+        sim.step(balls.FIXED_DT, policy.next_input(sim))
+        peak_balls = max(peak_balls, len(sim.balls))
+    
+    kills = sim.kills - start_kills
+    ttk = (sim.kill_ticks - start_kill_ticks) / kills * balls.FIXED_DT if kills else float("nan")
+    metrics = {
+        "seed": seed,
+        "ticks": sim.tick - start_tick,
+        "waves": sim.wave - start_wave,
+        "kills": kills,
+        "ttk_s": round(ttk, 3),
+        "peak_balls": peak_balls,
+        "score": sim.player.score - start_score,
+        "health": sim.player.health,
+        "wall_s": round(time.perf_counter() - start, 3)
+    }
+    return dict(params, **metrics)
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+# Сетка параметров: NAME=v1,v2,... -> список словарей (декартово произведение)
+def parse_grid(specs):
+    names = []
+    values = []
+    for spec in specs:
+        name, _, text = spec.partition("=")
+        if name not in balls.Balance._fields:
+            raise SystemExit(f"Неизвестный параметр баланса: {name} (есть: {', '.join(balls.Balance._fields)})")
+        names.append(name)
+        values.append([parse_value(v) for v in text.split(",")])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def print_table(rows, columns):
+    cells = [[str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетные прогоны симуляции для подбора баланса")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="NAME=V1,V2",
+                        help="значения параметра Balance; несколько -p дают декартово произведение")
+    parser.add_argument("--seeds", type=int, default=4,
+                        help="число зёрен на каждую комбинацию параметров")
+    parser.add_argument("--policy", default="aim",
+                        help="aim[:N] - бот, стреляющий каждые N тиков, или путь к записи ввода")
+    parser.add_argument("--max-ticks", type=int, default=DEFAULT_MAX_TICKS,
+                        help="предел длины одного прогона в тиках")
+    parser.add_argument("--state", metavar="PATH",
+                        help="начинать каждый прогон с контрольной точки (файл balls.write_state)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="число процессов (по умолчанию все ядра)")
+    parser.add_argument("--out", metavar="PATH",
+                        help="сохранить таблицу в CSV")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    grid = parse_grid(args.param)
+    jobs = [(params, seed, args.policy, args.max_ticks, args.state) for params in grid for seed in range(args.seeds)]
+    
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        rows = list(pool.map(run_one, jobs, chunksize=max(1, len(jobs) // (4 * args.workers))))
+    elapsed = time.perf_counter() - start
+    
+    columns = list(grid[0]) + list(METRIC_COLUMNS)
+    print_table(rows, columns)
+    print(f"Прогонов: {len(rows)}, процессов: {args.workers}, время: {elapsed:.1f} с", file=sys.stderr)
+    
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
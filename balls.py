@@ -1,15 +1,110 @@
-import pygame
+import os
+
+# Приветствие pygame в консоли не нужно ни игре, ни инструментам
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import argparse
+import collections
+import contextlib
+import copy
+import csv
+import gc
+import glob
+import importlib.util
+import itertools
+import json
 import math
+import queue
 import random
+import struct
 import sys
+import threading
+import time
+import traceback
+
+# Заглушка неустановленного модуля: ошибка - при первом обращении, а не при импорте balls
+class MissingModule:
+    def __init__(self, name):
+        self.name = name
+    
+    def __getattr__(self, attribute):
+        raise ModuleNotFoundError(f"Модуль {self.name} не установлен (pip install {self.name})", name=self.name)
+
+# Модуль загружается при первом обращении к его атрибутам
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return MissingModule(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-# Инициализация Pygame
-pygame.init()
+# Импорт pygame - самая долгая часть запуска, а симуляции, безголовым прогонам
+# и подбору баланса он не нужен
+pygame = lazy_import("pygame")
 
 # Настройки экрана
 WIDTH, HEIGHT = 800, 600
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Пиксельная 3D Аркада 90-х - От первого лица")
+
+# Фиксированный шаг симуляции (секунды)
+FIXED_DT = 1 / 60
+
+# Сколько тиков можно догнать за один медленный кадр
+MAX_STEPS_PER_FRAME = 5
+
+# Таймеры врагов раньше считались в кадрах при 60 FPS
+FRAME_TIME = 1 / 60
+
+# Кнопки ввода за тик (битовая маска)
+INPUT_FORWARD = 1
+INPUT_BACK = 2
+INPUT_LEFT = 4
+INPUT_RIGHT = 8
+INPUT_UP = 16
+INPUT_DOWN = 32
+INPUT_FIRE = 64
+INPUT_DEFLECT = 128
+INPUT_RESTART = 256
+
+# Клавиши движения (имена констант pygame) и соответствующие кнопки
+MOVE_KEYS = (
+    ("K_w", INPUT_FORWARD),
+    ("K_s", INPUT_BACK),
+    ("K_a", INPUT_LEFT),
+    ("K_d", INPUT_RIGHT),
+    ("K_q", INPUT_UP),
+    ("K_e", INPUT_DOWN)
+)
+
+# Поворот камеры на пиксель смещения мыши (радианы)
+MOUSE_SENSITIVITY = 0.002
+
+# Баланс врагов и волн; времена в кадрах при 60 FPS
+Balance = collections.namedtuple("Balance", (
+    "enemy_size", "enemy_size_per_level",
+    "enemy_health", "enemy_health_per_level",
+    "enemy_speed", "enemy_speed_per_level",
+    "first_shot_min", "first_shot_max", "first_shot_per_level",
+    "shoot_delay", "shoot_delay_per_level", "min_shoot_delay",
+    "wave_enemies", "enemies_per_wave"
+))
+DEFAULT_BALANCE = Balance(
+    enemy_size=8, enemy_size_per_level=1,
+    enemy_health=3, enemy_health_per_level=3,
+    enemy_speed=1, enemy_speed_per_level=0.3,
+    first_shot_min=100, first_shot_max=300, first_shot_per_level=20,
+    shoot_delay=300, shoot_delay_per_level=25, min_shoot_delay=50,
+    wave_enemies=3, enemies_per_wave=1
+)
+
+# Ввод за один тик: кнопки и смещение мыши
+TickInput = collections.namedtuple("TickInput", "buttons mouse_dx mouse_dy")
+IDLE_INPUT = TickInput(0, 0, 0)
 
 # Цвета
 BLACK = (0, 0, 0)
@@ -22,8 +117,48 @@ DARK_RED = (128, 0, 0)
 DARK_GREEN = (0, 128, 0)
 DARK_BLUE = (0, 0, 128)
 
+# Перспективная проекция: угол обзора по горизонтали (градусы) и ближняя плоскость
+DEFAULT_FOV = 90
+NEAR_PLANE = 0.1
+
+# Окно вывода: разрешение и угол обзора; render_scale - доля разрешения, в которой рисуется сцена
+class Viewport:
+    def __init__(self, width=WIDTH, height=HEIGHT, fov=DEFAULT_FOV, render_scale=1.0):
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.render_scale = render_scale
+        self.center_x = width // 2
+        self.center_y = height // 2
+        # Фокусное расстояние в пикселях; округление срезает погрешность tan: 90° при ширине 800 дают ровно 400
+        self.focal_length = round(width / 2 / math.tan(math.radians(fov) / 2), 9)
+        
+        # Боковые плоскости пирамиды видимости в системе камеры, нормали внутрь
+        planes = np.array([
+            (-self.focal_length, 0, width / 2),   # правая
+            (self.focal_length, 0, width / 2),    # левая
+            (0, -self.focal_length, height / 2),  # верхняя
+            (0, self.focal_length, height / 2)    # нижняя
+        ], dtype=float)
+        self.frustum_planes = planes / np.linalg.norm(planes, axis=1)[:, None]
+    
+    @property
+    def size(self):
+        return (self.width, self.height)
+    
+    # Та же камера в разрешении внутренней отрисовки
+    def scaled(self):
+        if self.render_scale == 1:
+            return self
+        width = max(1, round(self.width * self.render_scale))
+        height = max(1, round(self.height * self.render_scale))
+        return Viewport(width, height, self.fov)
+
 # 3D математика
 class Vector3:
+    # Без __dict__: векторов создаётся много, так они компактнее и быстрее создаются
+    __slots__ = ("x", "y", "z")
+    
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -38,6 +173,32 @@ class Vector3:
     def __mul__(self, scalar):
         return Vector3(self.x * scalar, self.y * scalar, self.z * scalar)
     
+    # Операции на месте: меняют этот вектор, новый не создаётся
+    def __iadd__(self, other):
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+    
+    def __isub__(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        self.z -= other.z
+        return self
+    
+    def __imul__(self, scalar):
+        self.x *= scalar
+        self.y *= scalar
+        self.z *= scalar
+        return self
+    
+    # self += other * scalar
+    def add_scaled(self, other, scalar):
+        self.x += other.x * scalar
+        self.y += other.y * scalar
+        self.z += other.z * scalar
+        return self
+    
     def length(self):
         return math.sqrt(self.x*self.x + self.y*self.y + self.z*self.z)
     
@@ -49,106 +210,128 @@ class Vector3:
     
     def dot(self, other):
         return self.x * other.x + self.y * other.y + self.z * other.z
+    
+    def as_tuple(self):
+        return (self.x, self.y, self.z)
 
-class Cube3D:
-    def __init__(self, position, size, color):
-        self.position = position
-        self.size = size
-        self.color = color
-        self.dark_color = (color[0]//2, color[1]//2, color[2]//2)
-    
-    def get_vertices(self):
-        s = self.size / 2
-        return [
-            Vector3(-s, -s, -s), Vector3(s, -s, -s),
-            Vector3(s, s, -s), Vector3(-s, s, -s),
-            Vector3(-s, -s, s), Vector3(s, -s, s),
-            Vector3(s, s, s), Vector3(-s, s, s)
-        ]
-    
-    def project(self, camera_pos, camera_forward, camera_right, camera_up):
-        vertices = self.get_vertices()
-        projected = []
-        
-        for vertex in vertices:
-            # Переводим в систему координат камеры
-            world_vertex = vertex + self.position
-            cam_relative = world_vertex - camera_pos
-            
-            # Проецируем на плоскость камеры
-            z = cam_relative.dot(camera_forward)
-            if z <= 0.1:  # За камерой
-                projected.append(None)
-                continue
-                
-            x = cam_relative.dot(camera_right)
-            y = cam_relative.dot(camera_up)
-            
-            # Перспективная проекция
-            scale = 400 / z
-            screen_x = WIDTH // 2 + x * scale
-            screen_y = HEIGHT // 2 - y * scale
-            
-            projected.append((screen_x, screen_y, scale))
-        
-        return projected
-    
-    def draw(self, screen, camera_pos, camera_forward, camera_right, camera_up):
-        projected = self.project(camera_pos, camera_forward, camera_right, camera_up)
-        
-        # Рисуем грани куба
-        faces = [
-            [0, 1, 2, 3],  # задняя
-            [4, 5, 6, 7],  # передняя
-            [0, 1, 5, 4],  # нижняя
-            [2, 3, 7, 6],  # верхняя
-            [0, 3, 7, 4],  # левая
-            [1, 2, 6, 5]   # правая
-        ]
-        
-        face_colors = [
-            self.dark_color,  # задняя
-            self.color,       # передняя
-            self.dark_color,  # нижняя
-            self.dark_color,  # верхняя
-            self.dark_color,  # левая
-            self.dark_color   # правая
-        ]
-        
-        # Сортируем грани по глубине
-        face_depths = []
-        for i, face in enumerate(faces):
-            z_sum = 0
-            count = 0
-            for vertex_idx in face:
-                if projected[vertex_idx]:
-                    world_vertex = self.get_vertices()[vertex_idx] + self.position
-                    z_sum += (world_vertex - camera_pos).dot(camera_forward)
-                    count += 1
-            if count > 0:
-                face_depths.append((i, z_sum / count))
-        
-        face_depths.sort(key=lambda x: -x[1])
-        
-        for face_idx, _ in face_depths:
-            face = faces[face_idx]
-            color = face_colors[face_idx]
-            
-            points = []
-            valid = True
-            for vertex_idx in face:
-                if projected[vertex_idx]:
-                    points.append((projected[vertex_idx][0], projected[vertex_idx][1]))
-                else:
-                    valid = False
-                    break
-            
-            if valid and len(points) >= 3:
-                pygame.draw.polygon(screen, color, points)
-                for i in range(len(points)):
-                    start = points[i]
-                    end = points[(i + 1) % len(points)]
-                    pygame.draw.line(screen, BLACK, start, end, 2)
+# Проекция по умолчанию: окно 800x600
+DEFAULT_VIEWPORT = Viewport()
+
+# Пакетная проекция точек (N, 3) на экран; basis - строки вправо, вверх, вперёд
+def project_points(points, camera_pos, basis, viewport=DEFAULT_VIEWPORT):
+    cam_relative = (points - camera_pos) @ basis.T
+    depth = cam_relative[:, 2]
+    visible = depth > NEAR_PLANE  # Перед камерой
+    scale = viewport.focal_length / np.where(visible, depth, 1.0)
+    screen_x = viewport.center_x + cam_relative[:, 0] * scale
+    screen_y = viewport.center_y - cam_relative[:, 1] * scale
+    return screen_x, screen_y, scale, depth, visible
+
+# Запас области прицела вокруг шара на экране (пиксели)
+PICK_MARGIN = 10
+
+# Шары заданного типа под прицелом: один проход проекции. На экране это круг радиуса
+# шара + PICK_MARGIN вокруг центра, в мире - конус вокруг оси камеры
+def pick_balls(balls, kind, camera_pos, basis, viewport=DEFAULT_VIEWPORT):
+    indices = balls.live_indices(kind)
+    screen_x, screen_y, scale, _, visible = project_points(balls.positions[indices], camera_pos, basis, viewport)
+    distance = np.hypot(screen_x - viewport.center_x, screen_y - viewport.center_y)
+    ball_radius = np.maximum(2, (balls.radii[indices] * scale).astype(int))
+    return indices[visible & (distance < ball_radius + PICK_MARGIN)]
+
+# Дальше этого расстояния объекты не рисуются
+RENDER_DISTANCE = 500
+
+# Объекты, чей радиус на экране меньше стольких пикселей, рисуются точкой
+LOD_PIXELS = 1
+
+# Пакетное отсечение ограничивающих сфер: (рисовать полностью, рисовать точкой)
+def cull_spheres(centers, radii, camera_pos, basis, viewport=DEFAULT_VIEWPORT):
+    cam_relative = (centers - camera_pos) @ basis.T
+    depth = cam_relative[:, 2]
+    inside = (depth + radii > NEAR_PLANE) & (depth - radii < RENDER_DISTANCE)
+    inside &= (cam_relative @ viewport.frustum_planes.T > -radii[:, None]).all(axis=1)
+    tiny = inside & (radii * viewport.focal_length < LOD_PIXELS * depth)
+    return inside & ~tiny, tiny
+
+# Одиночный пиксель и точка 2x2, как у pygame.draw.circle радиуса 1
+PIXEL_STAMP = np.array(((0, 0),))
+DOT_STAMP = np.array(((-1, -1), (0, -1), (-1, 0), (0, 0)))
+
+# Рисуем пачку точек прямой записью пикселей, порядок как у поточечной отрисовки
+def plot_points(screen, x, y, colors, stamp=PIXEL_STAMP):
+    px = (x[:, None] + stamp[:, 0]).ravel()
+    py = (y[:, None] + stamp[:, 1]).ravel()
+    colors = np.repeat(colors, len(stamp), axis=0)
+    width, height = screen.get_size()
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+    
+    if screen.get_bitsize() not in (24, 32):
+        for point_x, point_y, color in zip(px[inside].tolist(), py[inside].tolist(), colors[inside].tolist()):
+            screen.set_at((point_x, point_y), color)
+        return
+    
+    pixels = pygame.surfarray.pixels3d(screen)
+    pixels[px[inside], py[inside]] = colors[inside]
+    del pixels  # Снимаем блокировку поверхности
+
+# Вершины единичного куба
+CUBE_CORNERS = np.array([
+    (-0.5, -0.5, -0.5), (0.5, -0.5, -0.5),
+    (0.5, 0.5, -0.5), (-0.5, 0.5, -0.5),
+    (-0.5, -0.5, 0.5), (0.5, -0.5, 0.5),
+    (0.5, 0.5, 0.5), (-0.5, 0.5, 0.5)
+])
+
+# Грани куба и их внешние нормали
+CUBE_FACES = np.array([
+    [0, 1, 2, 3],  # задняя
+    [4, 5, 6, 7],  # передняя
+    [0, 1, 5, 4],  # нижняя
+    [2, 3, 7, 6],  # верхняя
+    [0, 3, 7, 4],  # левая
+    [1, 2, 6, 5]   # правая
+])
+CUBE_FACE_NORMALS = np.array([
+    (0, 0, -1), (0, 0, 1),
+    (0, -1, 0), (0, 1, 0),
+    (-1, 0, 0), (1, 0, 0)
+], dtype=float)
+
+# Радиус сферы, описанной вокруг куба со стороной 1
+CUBE_BOUNDING_RADIUS = math.sqrt(3) / 2
+
+# Цвета граней кубов (N, 6, 3): передняя - цвет куба, остальные вдвое темнее
+def cube_face_colors(colors):
+    face_colors = np.repeat(colors[:, None, :] // 2, len(CUBE_FACES), axis=1)
+    face_colors[:, 1] = colors
+    return face_colors
+
+# Кубы с центрами positions (N, 3) и сторонами sizes (N,): одна проекция вершин и отсечение задних граней.
+# Видимые грани: экранные вершины (K, 4, 2), глубины вершин (K, 4), номера кубов и граней
+def visible_cube_faces(positions, sizes, camera_pos, basis, viewport=DEFAULT_VIEWPORT):
+    count = len(positions)
+    vertices = (CUBE_CORNERS[None, :, :] * sizes[:, None, None] + positions[:, None, :]).reshape(-1, 3)
+    screen_x, screen_y, _, depth, visible = project_points(vertices, camera_pos, basis, viewport)
+    screen_x = screen_x.reshape(count, 8)[:, CUBE_FACES]
+    screen_y = screen_y.reshape(count, 8)[:, CUBE_FACES]
+    depth = depth.reshape(count, 8)[:, CUBE_FACES]
+    visible = visible.reshape(count, 8)[:, CUBE_FACES]
+    
+    # Грань видна, если смотрит на камеру и все её вершины перед камерой
+    centers = positions[:, None, :] + CUBE_FACE_NORMALS[None, :, :] * (sizes / 2)[:, None, None]
+    facing = np.einsum("ijk,jk->ij", np.asarray(camera_pos) - centers, CUBE_FACE_NORMALS) > 0
+    cube_idx, face_idx = np.nonzero(facing & visible.all(axis=2))
+    points = np.stack((screen_x[cube_idx, face_idx], screen_y[cube_idx, face_idx]), axis=2)
+    return points, depth[cube_idx, face_idx], cube_idx, face_idx
+
+# Рисуем грани кубов: общая сортировка граней по глубине, дальние рисуются первыми
+def draw_cube_faces(screen, face_colors, points, depth, cube_idx, face_idx):
+    order = np.argsort(-depth.mean(axis=1), kind="stable")
+    colors = face_colors[cube_idx[order], face_idx[order]].tolist()
+    for points, color in zip(points[order].tolist(), colors):
+        pygame.draw.polygon(screen, color, points)
+        pygame.draw.lines(screen, BLACK, True, points, 2)
 
 # Игрок от первого лица
 class Player:
@@ -182,132 +365,526 @@ class Player:
         
         return forward, right, up
     
-    def move(self, keys, dt):
+    def get_camera_basis(self):
+        # Матрица 3x3 для project_points
+        forward, right, up = self.get_camera_vectors()
+        return np.array((right.as_tuple(), up.as_tuple(), forward.as_tuple()))
+    
+    def move(self, buttons, dt):
         speed = 5 * dt
         forward, right, up = self.get_camera_vectors()
         
-        if keys[pygame.K_w]:
-            self.position = self.position + forward * speed
-        if keys[pygame.K_s]:
-            self.position = self.position + forward * -speed
-        if keys[pygame.K_a]:
-            self.position = self.position + right * -speed
-        if keys[pygame.K_d]:
-            self.position = self.position + right * speed
-        if keys[pygame.K_q]:
+        if buttons & INPUT_FORWARD:
+            self.position.add_scaled(forward, speed)
+        if buttons & INPUT_BACK:
+            self.position.add_scaled(forward, -speed)
+        if buttons & INPUT_LEFT:
+            self.position.add_scaled(right, -speed)
+        if buttons & INPUT_RIGHT:
+            self.position.add_scaled(right, speed)
+        if buttons & INPUT_UP:
             self.position.y += speed
-        if keys[pygame.K_e]:
+        if buttons & INPUT_DOWN:
             self.position.y -= speed
         
         # Ограничение движения по Y (чтобы не улететь)
         self.position.y = max(-10, min(10, self.position.y))
     
+    # Копия для снимка состояния: своя позиция, остальные поля - числа
+    def copy(self):
+        player = copy.copy(self)
+        player.position = Vector3(*self.position.as_tuple())
+        return player
+    
     def rotate(self, mouse_rel):
-        sensitivity = 0.002
-        self.yaw += mouse_rel[0] * sensitivity
-        self.pitch += mouse_rel[1] * sensitivity
+        self.yaw += mouse_rel[0] * MOUSE_SENSITIVITY
+        self.pitch += mouse_rel[1] * MOUSE_SENSITIVITY
         self.pitch = max(-math.pi/2, min(math.pi/2, self.pitch))
 
-# Враг
-class Enemy:
-    def __init__(self, position, level):
-        self.position = position
-        self.level = level
-        self.size = 8 + level * 1
-        self.health = 3 + (level - 1) * 3
-        self.max_health = self.health
-        self.speed = 1 + level * 0.3
-        self.shoot_timer = random.randint(100, 300) - level * 20
-        self.shoot_delay = max(50, 300 - level * 25)
-        self.color = (min(255, 50 + level * 40), max(0, 200 - level * 30), 50)
-        self.cube = Cube3D(self.position, self.size, self.color)
-        self.wobble = random.random() * math.pi * 2
-    
-    def draw(self, screen, camera_pos, forward, right, up):
-        self.cube.position = self.position
-        self.cube.color = self.color
-        self.cube.size = self.size
-        self.cube.draw(screen, camera_pos, forward, right, up)
-    
-    def update(self, player_pos, dt):
-        self.wobble += dt
-        # Плавное движение
-        self.position.y += math.sin(self.wobble * 2) * 0.3
-        
-        # Движение к игроку, но сохраняя дистанцию
-        to_player = player_pos - self.position
-        distance = to_player.length()
-        
-        if distance > 30 and distance < 100:
-            move_dir = to_player.normalize()
-            self.position = self.position + move_dir * self.speed * dt
-        
-        self.shoot_timer -= 1
-    
-    def should_shoot(self):
-        return self.shoot_timer <= 0
-    
-    def reset_shoot_timer(self):
-        self.shoot_timer = self.shoot_delay
-
-# 3D шар
-class Ball3D:
-    def __init__(self, position, velocity, color, radius=4):
-        self.position = position
-        self.velocity = velocity
-        self.color = color
-        self.radius = radius
-        self.light_color = (min(255, color[0] + 50), min(255, color[1] + 50), min(255, color[2] + 50))
-    
-    def update(self, dt):
-        self.position = self.position + self.velocity * dt
-    
-    def draw(self, screen, camera_pos, forward, right, up):
-        # Переводим в систему координат камеры
-        cam_relative = self.position - camera_pos
-        z = cam_relative.dot(forward)
-        
-        if z <= 0.1:  # За камерой
+# Хранилище архетипа: каждый компонент лежит в своём массиве, сущность - строка во всех массивах.
+# columns: имя компонента -> (форма строки, тип); системы обрабатывают столбцы целиком
+class Archetype:
+    columns = {}
+    
+    def __init__(self, capacity=256):
+        self.count = 0
+        for name, (shape, dtype) in self.columns.items():
+            setattr(self, name, np.zeros((capacity,) + shape, dtype=dtype))
+    
+    def __len__(self):
+        return self.count
+    
+    def grow(self, capacity):
+        # Увеличиваем все массивы, сохраняя занятую часть
+        for name in self.columns:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+    
+    # Строки под k новых сущностей со сквозными номерами; массивы при нехватке растут вдвое
+    def reserve(self, k):
+        capacity = len(self.ids)
+        if self.count + k > capacity:
+            self.grow(max(2 * capacity, self.count + k))
+        new = slice(self.count, self.count + k)
+        self.ids[new] = list(itertools.islice(self.id_counter, k))
+        self.count += k
+        return new
+    
+    # Удаление с сохранением порядка оставшихся строк; dead - маска длины count
+    def remove(self, dead):
+        keep = ~dead
+        live_count = int(np.count_nonzero(keep))
+        for name in self.columns:
+            array = getattr(self, name)
+            array[:live_count] = array[:self.count][keep]
+        self.count = live_count
+    
+    # Копия занятой части только для чтения: не меняется при следующих шагах
+    def snapshot(self):
+        pool = copy.copy(self)
+        for name in self.columns:
+            array = getattr(self, name)[:self.count].copy()
+            array.flags.writeable = False
+            setattr(pool, name, array)
+        return pool
+    
+    # Возврат к снимку: строки копируются в свои массивы; номера новых сущностей не совпадут с восстановленными
+    def load(self, snapshot):
+        count = snapshot.count
+        if count > len(self.ids):
+            self.grow(count)
+        for name in self.columns:
+            getattr(self, name)[:count] = getattr(snapshot, name)
+        self.count = count
+        if count:
+            last_id = int(self.ids[:count].max())
+            if next(self.id_counter) <= last_id:
+                type(self).id_counter = itertools.count(last_id + 1)
+
+# Враги: параметры строки задаются уровнем и балансом при появлении
+class EnemyPool(Archetype):
+    columns = {
+        "positions": ((3,), float),
+        "sizes": ((), float),
+        "speeds": ((), float),
+        "health": ((), float),
+        "shoot_timers": ((), float),  # Секунды
+        "shoot_delays": ((), float),
+        "wobbles": ((), float),  # Фаза покачивания
+        "colors": ((3,), np.int64),
+        "ids": ((), np.int64)
+    }
+    
+    # Сквозная нумерация врагов: по номеру снимки сопоставляются между тиками
+    id_counter = itertools.count()
+    
+    def spawn(self, position, level, rng, balance=DEFAULT_BALANCE):
+        i = self.reserve(1).start
+        self.positions[i] = position
+        self.sizes[i] = balance.enemy_size + level * balance.enemy_size_per_level
+        self.health[i] = balance.enemy_health + (level - 1) * balance.enemy_health_per_level
+        self.speeds[i] = balance.enemy_speed + level * balance.enemy_speed_per_level
+        first_shot = rng.randint(balance.first_shot_min, balance.first_shot_max) - level * balance.first_shot_per_level
+        self.shoot_timers[i] = first_shot * FRAME_TIME
+        self.shoot_delays[i] = max(balance.min_shoot_delay, balance.shoot_delay - level * balance.shoot_delay_per_level) * FRAME_TIME
+        self.colors[i] = (min(255, 50 + level * 40), max(0, 200 - level * 30), 50)
+        self.wobbles[i] = rng.random() * math.pi * 2
+        return i
+    
+    # Плавное покачивание по вертикали, у каждого врага своя фаза
+    def wobble(self, dt):
+        n = self.count
+        self.wobbles[:n] += dt
+        self.positions[:n, 1] += np.sin(self.wobbles[:n] * 2) * 0.3 * dt / FRAME_TIME
+    
+    # Движение к цели, но сохраняя дистанцию: двигаются только враги на расстоянии от near до far
+    def approach(self, target, dt, near=30, far=100):
+        n = self.count
+        offset = target - self.positions[:n]
+        squares = offset * offset
+        distance = np.sqrt(squares[:, 0] + squares[:, 1] + squares[:, 2])
+        moving = (distance > near) & (distance < far)
+        move_dir = offset / np.where(moving, distance, 1.0)[:, None] * self.speeds[:n, None]
+        self.positions[:n] += np.where(moving[:, None], move_dir * dt, 0.0)
+    
+    # Таймеры выстрелов: номера врагов, которым пора стрелять; их таймеры взводятся заново
+    def shooters(self, dt):
+        n = self.count
+        self.shoot_timers[:n] -= dt
+        ready = np.flatnonzero(self.shoot_timers[:n] <= 0)
+        if len(ready):
+            self.shoot_timers[ready] = self.shoot_delays[ready]
+        return ready
+
+# Типы шаров
+BALL_PLAYER = 0
+BALL_ENEMY = 1
+BALL_BOUNCED = 2
+
+# Параметры шаров по типам: скорость, радиус, цвет
+BALL_SPEEDS = (15, 8, 12)
+BALL_RADII = (3, 3, 4)
+BALL_COLORS = (RED, GREEN, (100, 255, 100))
+BALL_COLOR_ARRAY = np.array(BALL_COLORS)
+BALL_LIGHT_COLORS = tuple((min(255, r + 50), min(255, g + 50), min(255, b + 50)) for r, g, b in BALL_COLORS)
+BALL_LIGHT_COLOR_ARRAY = np.array(BALL_LIGHT_COLORS)
+
+# Урон по врагам, урон по игроку и очки за убитого врага (умножаются на уровень) по типам шаров:
+# новый тип снаряда - новые строки таблиц, а не новый цикл столкновений
+BALL_ENEMY_DAMAGE = np.array((1, 0, 2))
+BALL_PLAYER_DAMAGE = np.array((0, 1, 0))
+BALL_KILL_SCORES = (10, 0, 15)
+ENEMY_HITTERS = np.flatnonzero(BALL_ENEMY_DAMAGE).tolist()
+PLAYER_HITTERS = np.flatnonzero(BALL_PLAYER_DAMAGE).tolist()
+
+# Радиус столкновения игрока с шарами
+PLAYER_RADIUS = 2
+
+# Шары дальше этого расстояния от игрока удаляются
+BALL_MAX_DISTANCE = 500
+
+# Пул 3D шаров: позиции, скорости, радиусы и типы лежат в массивах NumPy
+class BallPool(Archetype):
+    columns = {
+        "positions": ((3,), float),
+        "velocities": ((3,), float),
+        "radii": ((), float),
+        "kinds": ((), np.int8),
+        "alive": ((), bool),
+        "ids": ((), np.int64)
+    }
+    
+    # Сквозная нумерация шаров: номер не меняется при перестановках в пуле
+    id_counter = itertools.count()
+    
+    def spawn(self, position, direction, kind):
+        dx, dy, dz = direction
+        length = math.sqrt(dx*dx + dy*dy + dz*dz)
+        speed = BALL_SPEEDS[kind] / length if length > 0 else 0
+        
+        i = self.reserve(1).start
+        self.positions[i] = position
+        self.velocities[i] = (dx * speed, dy * speed, dz * speed)
+        self.radii[i] = BALL_RADII[kind]
+        self.kinds[i] = kind
+        self.alive[i] = True
+        return i
+    
+    # Пачка шаров одного типа: positions и directions - массивы (K, 3)
+    def spawn_many(self, positions, directions, kind):
+        dx, dy, dz = directions.T
+        length = np.sqrt(dx*dx + dy*dy + dz*dz)
+        speed = BALL_SPEEDS[kind] / np.where(length > 0, length, np.inf)
+        
+        new = self.reserve(len(positions))
+        self.positions[new] = positions
+        self.velocities[new] = directions * speed[:, None]
+        self.radii[new] = BALL_RADII[kind]
+        self.kinds[new] = kind
+        self.alive[new] = True
+    
+    def live_indices(self, kind):
+        n = self.count
+        return np.flatnonzero(self.alive[:n] & (self.kinds[:n] == kind))
+    
+    # Живые шары нескольких типов: по типам по порядку, внутри типа - по месту в пуле
+    def live_indices_of(self, kinds):
+        if len(kinds) == 1:
+            return self.live_indices(kinds[0])
+        return np.concatenate([self.live_indices(kind) for kind in kinds])
+    
+    def integrate(self, dt):
+        n = self.count
+        self.positions[:n] += self.velocities[:n] * dt
+    
+    def cull(self, center, max_distance):
+        # Помечаем шары, улетевшие слишком далеко
+        n = self.count
+        offset = self.positions[:n] - center
+        far = np.einsum("ij,ij->i", offset, offset) > max_distance * max_distance
+        self.alive[:n] &= ~far
+    
+    def kill(self, indices):
+        self.alive[indices] = False
+    
+    def compact(self):
+        # Удаление перестановкой: живые шары из хвоста переносим в дыры
+        n = self.count
+        alive = self.alive[:n]
+        live_count = int(np.count_nonzero(alive))
+        if live_count == n:
             return
         
-        x = cam_relative.dot(right)
-        y = cam_relative.dot(up)
-        
-        # Перспективная проекция
-        scale = 400 / z
-        screen_x = WIDTH // 2 + x * scale
-        screen_y = HEIGHT // 2 - y * scale
-        
-        draw_radius = max(2, int(self.radius * scale))
-        
-        # Рисуем пиксельную сферу
-        pygame.draw.circle(screen, self.color, (int(screen_x), int(screen_y)), draw_radius)
-        pygame.draw.circle(screen, self.light_color, (int(screen_x), int(screen_y)), max(1, draw_radius - 2))
-        pygame.draw.circle(screen, BLACK, (int(screen_x), int(screen_y)), draw_radius, 1)
-    
-    def is_off_screen(self, camera_pos):
-        relative_pos = self.position - camera_pos
-        return relative_pos.length() > 500
-
-# Шар игрока
-class PlayerBall(Ball3D):
-    def __init__(self, position, direction):
-        velocity = direction.normalize() * 15
-        super().__init__(position, velocity, RED, 3)
-
-# Шар врага
-class EnemyBall(Ball3D):
-    def __init__(self, position, target_pos):
-        direction = (target_pos - position).normalize()
-        velocity = direction * 8
-        super().__init__(position, velocity, GREEN, 3)
-
-# Отскочивший шар
-class BouncedBall(Ball3D):
-    def __init__(self, position, target_pos):
-        direction = (target_pos - position).normalize()
-        velocity = direction * 12
-        super().__init__(position, velocity, (100, 255, 100), 4)
+        holes = np.flatnonzero(~alive[:live_count])
+        movers = np.flatnonzero(alive[live_count:]) + live_count
+        for name in self.columns:
+            array = getattr(self, name)
+            array[holes] = array[movers]
+        self.alive[live_count:n] = False
+        self.count = live_count
+
+# До стольких пар шар-враг сетка не нужна: проверяем все пары сразу
+BRUTE_FORCE_PAIRS = 4096
+
+# Смещения соседних ячеек сетки (3x3x3)
+NEIGHBOR_OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)], dtype=np.int64)
+
+# Равномерная 3D сетка для широкой фазы столкновений
+class SpatialHash:
+    def __init__(self, cell_size=10):
+        self.cell_size = cell_size
+        self.keys = np.empty(0, dtype=np.int64)
+        self.order = np.empty(0, dtype=np.intp)
+    
+    def cells(self, points):
+        return np.floor(points / self.cell_size).astype(np.int64)
+    
+    @staticmethod
+    def pack(cells):
+        # Упаковываем координаты ячейки в один ключ (по 21 биту на ось)
+        c = cells + (1 << 20)
+        return (c[:, 0] << 42) | (c[:, 1] << 21) | c[:, 2]
+    
+    def build(self, points, cell_size):
+        # Перестраиваем сетку: объекты сортируются по ключу ячейки
+        self.cell_size = cell_size
+        keys = self.pack(self.cells(points))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+    
+    def query_pairs(self, points):
+        # Пары (точка, объект) из соседних ячеек; размер ячейки не меньше радиуса поиска
+        cells = self.cells(points)
+        keys = self.pack((cells[:, None, :] + NEIGHBOR_OFFSETS[None, :, :]).reshape(-1, 3))
+        lo = np.searchsorted(self.keys, keys, "left")
+        counts = np.searchsorted(self.keys, keys, "right") - lo
+        total = int(counts.sum())
+        
+        ends = np.cumsum(counts)
+        slots = np.repeat(lo - ends + counts, counts) + np.arange(total)
+        queries = np.repeat(np.arange(len(keys)) // len(NEIGHBOR_OFFSETS), counts)
+        return queries, self.order[slots]
+    
+    # Номер ближайшего объекта для каждой точки; targets - точки, по которым построена сетка.
+    # Всё за соседними ячейками не ближе размера ячейки, поэтому кандидат ближе - точный ответ;
+    # для остальных точек сетка перестраивается с вдвое большими ячейками
+    def nearest(self, points, targets):
+        nearest = np.zeros(len(points), dtype=np.intp)
+        remaining = np.arange(len(points))
+        while len(remaining):
+            queries, found = self.query_pairs(points[remaining])
+            offset = points[remaining][queries] - targets[found]
+            distance = offset[:, 0] * offset[:, 0] + offset[:, 1] * offset[:, 1] + offset[:, 2] * offset[:, 2]
+            
+            # Ближайший кандидат; при равных расстояниях - с меньшим номером, как у min()
+            best = np.full(len(remaining), np.inf)
+            np.minimum.at(best, queries, distance)
+            closest = distance == best[queries]
+            first = np.full(len(remaining), len(targets))
+            np.minimum.at(first, queries[closest], found[closest])
+            
+            exact = best < self.cell_size * self.cell_size
+            nearest[remaining[exact]] = first[exact]
+            remaining = remaining[~exact]
+            if len(remaining):
+                self.build(targets, 2 * self.cell_size)
+        return nearest
+
+# Ближайший объект перебором всех пар; при равных расстояниях - первый, как у min()
+def nearest_points(points, targets):
+    offset = points[:, None, :] - targets[None, :, :]
+    distance = offset[..., 0] * offset[..., 0] + offset[..., 1] * offset[..., 1] + offset[..., 2] * offset[..., 2]
+    return np.argmin(distance, axis=1)
+
+# Рисуем 3D шар по уже спроецированному центру
+def draw_ball(screen, screen_x, screen_y, draw_radius, kind):
+    # Рисуем пиксельную сферу
+    pygame.draw.circle(screen, BALL_COLORS[kind], (screen_x, screen_y), draw_radius)
+    pygame.draw.circle(screen, BALL_LIGHT_COLORS[kind], (screen_x, screen_y), max(1, draw_radius - 2))
+    pygame.draw.circle(screen, BLACK, (screen_x, screen_y), draw_radius, 1)
+
+# Шары крупнее этого радиуса на экране рисуются напрямую, без кэша спрайтов
+SPRITE_MAX_RADIUS = 64
+
+# Прозрачный цвет спрайтов (в шарах не встречается)
+SPRITE_COLORKEY = (255, 0, 255)
+
+# Кэш заранее нарисованных спрайтов шаров по (тип, радиус на экране)
+class BallSprites:
+    def __init__(self, screen):
+        self.screen = screen
+        self.sprites = {}
+    
+    def get(self, kind, radius):
+        key = (kind, radius)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            # Круг радиуса r у pygame занимает квадрат 2r x 2r вокруг центра
+            sprite = pygame.Surface((2 * radius, 2 * radius), 0, self.screen)
+            sprite.fill(SPRITE_COLORKEY)
+            draw_ball(sprite, radius, radius, radius, kind)
+            sprite.set_colorkey(SPRITE_COLORKEY, pygame.RLEACCEL)
+            self.sprites[key] = sprite
+        return sprite
+
+# Предел числа пикселей за один проход растеризатора (по площади описанных прямоугольников)
+RASTER_CHUNK_PIXELS = 1 << 21
+
+# Программный растеризатор: буферы цвета и глубины в порядке surfarray (индекс x * height + y)
+class DepthBuffer:
+    def __init__(self, size):
+        self.width, self.height = size
+        self.color = np.zeros((self.width * self.height, 3), dtype=np.uint8)
+        # Храним 1/z: она линейна в экранных координатах; 0 - пустой пиксель
+        self.inv_depth = np.zeros(self.width * self.height)
+    
+    def clear(self):
+        self.color[:] = BLACK
+        self.inv_depth[:] = 0
+    
+    def present(self, screen):
+        pygame.surfarray.blit_array(screen, self.color.reshape(self.width, self.height, 3))
+    
+    # Ранний тест глубины: фрагменты ближе уже записанных
+    def depth_test(self, px, py, inv_depth):
+        return inv_depth > self.inv_depth[px * self.height + py]
+    
+    # Запись фрагментов: среди попавших в один пиксель побеждает ближний (большее 1/z)
+    def write(self, px, py, inv_depth, colors):
+        pixels = px * self.height + py
+        np.maximum.at(self.inv_depth, pixels, inv_depth)
+        nearest = inv_depth >= self.inv_depth[pixels]
+        self.color[pixels[nearest]] = colors[nearest]
+    
+    # Строки фигур в прямоугольниках [x0, x1] x [y0, y1], порциями: (номера фигур, y);
+    # фигура целиком попадает в одну порцию
+    def rows(self, x0, y0, x1, y1):
+        top = np.clip(np.ceil(y0 - 0.5), 0, self.height).astype(int)
+        bottom = np.clip(np.floor(y1 - 0.5) + 1, 0, self.height).astype(int)
+        heights = np.maximum(bottom - top, 0)
+        widths = np.clip(x1, 0, self.width) - np.clip(x0, 0, self.width) + 1
+        ends = np.cumsum(heights * widths)
+        
+        start = 0
+        while start < len(heights):
+            limit = ends[start] - heights[start] * widths[start] + RASTER_CHUNK_PIXELS
+            stop = max(int(np.searchsorted(ends, limit, "right")), start + 1)
+            counts = heights[start:stop]
+            shape = np.repeat(np.arange(start, stop), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            yield shape, top[shape] + offsets
+            start = stop
+    
+    # Отрезки строк [left, right] -> пиксели, центры которых внутри отрезка
+    def spans(self, shape, py, left, right):
+        x0 = np.clip(np.ceil(left - 0.5), 0, self.width).astype(int)
+        x1 = np.clip(np.floor(right - 0.5) + 1, 0, self.width).astype(int)
+        counts = np.maximum(x1 - x0, 0)
+        row = np.repeat(np.arange(len(counts)), counts)
+        px = x0[row] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return shape[row], px, py[row]
+    
+    def plot(self, x, y, depth, colors, stamp=PIXEL_STAMP):
+        px = (x[:, None] + stamp[:, 0]).ravel()
+        py = (y[:, None] + stamp[:, 1]).ravel()
+        inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        inv_depth = np.repeat(1 / depth, len(stamp))
+        colors = np.repeat(colors, len(stamp), axis=0)
+        self.write(px[inside], py[inside], inv_depth[inside], colors[inside])
+    
+    # Диски шаров: заливка, светлая середина и контур, как у draw_ball
+    def fill_discs(self, x, y, radius, depth, kinds):
+        # Ближние первыми: заслонённые фрагменты дальних отсекаются до раскраски
+        order = np.argsort(depth, kind="stable")
+        x, y, radius, depth, kinds = x[order], y[order], radius[order], depth[order], kinds[order]
+        
+        for shape, py in self.rows(x - radius, y - radius, x + radius, y + radius):
+            dy = py + 0.5 - y[shape]
+            half = np.sqrt(np.maximum(radius[shape] ** 2 - dy * dy, 0))
+            shape, px, py = self.spans(shape, py, x[shape] - half, x[shape] + half)
+            inv_depth = 1 / depth[shape]
+            front = self.depth_test(px, py, inv_depth)
+            shape, px, py, inv_depth = shape[front], px[front], py[front], inv_depth[front]
+            
+            r = radius[shape]
+            kind = kinds[shape]
+            distance = np.hypot(px + 0.5 - x[shape], py + 0.5 - y[shape])
+            light = distance <= np.maximum(1, r - 2)
+            colors = np.where(light[:, None], BALL_LIGHT_COLOR_ARRAY[kind], BALL_COLOR_ARRAY[kind])
+            colors[distance > r - 1] = BLACK
+            self.write(px, py, inv_depth, colors)
+    
+    # Выпуклые грани: points (K, 4, 2) на экране, depth (K, 4) по вершинам, colors (K, 3)
+    def fill_quads(self, points, depth, colors):
+        # Удвоенная площадь треугольника (0, 1, 2): по нему строится плоскость 1/z
+        e1 = points[:, 1] - points[:, 0]
+        e2 = points[:, 2] - points[:, 0]
+        area = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+        keep = np.abs(area) > 0.5  # Грани ребром к камере не дают пикселей
+        order = np.argsort(depth.min(axis=1)[keep], kind="stable")
+        points, depth, colors, area = points[keep][order], depth[keep][order], colors[keep][order], area[keep][order]
+        e1, e2 = e1[keep][order], e2[keep][order]
+        
+        # 1/z на экране: inv0 + (p - p0) . gradient
+        inv = 1 / depth
+        d1 = inv[:, 1] - inv[:, 0]
+        d2 = inv[:, 2] - inv[:, 0]
+        gradient = np.stack(((d1 * e2[:, 1] - d2 * e1[:, 1]) / area, (d2 * e1[:, 0] - d1 * e2[:, 0]) / area), axis=1)
+        
+        # Рёбра i -> i + 1, ориентированные так, что внутренность грани слева (функция ребра >= 0)
+        edges = (np.roll(points, -1, axis=1) - points) * np.sign(area)[:, None, None]
+        lengths = np.maximum(np.hypot(edges[..., 0], edges[..., 1]), 1e-9)
+        
+        low = points.min(axis=1)
+        high = points.max(axis=1)
+        for shape, py in self.rows(low[:, 0], low[:, 1], high[:, 0], high[:, 1]):
+            # Каждое ребро ограничивает строку слева или справа: k * x + m >= 0
+            qy = (py + 0.5)[:, None]
+            edge = edges[shape]
+            start = points[shape]
+            k = -edge[..., 1]
+            m = edge[..., 0] * (qy - start[..., 1]) + edge[..., 1] * start[..., 0]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                bound = -m / k
+            left = np.where(k > 0, bound, -np.inf).max(axis=1)
+            right = np.where(k < 0, bound, np.inf).min(axis=1)
+            right[((k == 0) & (m < 0)).any(axis=1)] = -np.inf
+            shape, px, py = self.spans(shape, py, np.maximum(left, low[shape, 0]), np.minimum(right, high[shape, 0]))
+            
+            qx = px + 0.5
+            qy = py + 0.5
+            inv_depth = inv[shape, 0] + (qx - points[shape, 0, 0]) * gradient[shape, 0] + (qy - points[shape, 0, 1]) * gradient[shape, 1]
+            front = self.depth_test(px, py, inv_depth)
+            shape, px, py, qx, qy, inv_depth = shape[front], px[front], py[front], qx[front], qy[front], inv_depth[front]
+            
+            # Контур толщиной 2 пикселя: расстояние до ближайшего ребра меньше 1
+            edge = edges[shape]
+            start = points[shape]
+            distance = (edge[..., 0] * (qy[:, None] - start[..., 1]) - edge[..., 1] * (qx[:, None] - start[..., 0])) / lengths[shape]
+            fragment_colors = colors[shape]
+            fragment_colors[distance.min(axis=1) < 1] = BLACK
+            self.write(px, py, inv_depth, fragment_colors)
+
+# Сетка пола: точки в мире строятся один раз, рисуются пачкой
+class FloorGrid:
+    def __init__(self, extent=20, spacing=10, height=-5):
+        cells = np.arange(-extent, extent + 1) * spacing
+        grid_x, grid_z = np.meshgrid(cells, cells, indexing="ij")
+        self.points = np.stack((grid_x.ravel(), np.full(grid_x.size, height), grid_z.ravel()), axis=1).astype(float)
+    
+    # Видимые узлы сетки: экранные координаты, глубина и цвет (темнее вдали)
+    def project(self, camera_pos, basis, viewport=DEFAULT_VIEWPORT):
+        screen_x, screen_y, _, depth, visible = project_points(self.points, camera_pos, basis, viewport)
+        shown = visible & (screen_x >= 0) & (screen_x < viewport.width) & (screen_y >= 0) & (screen_y < viewport.height)
+        brightness = np.clip((255 * (1 - depth[shown] / 200)).astype(int), 0, 255)
+        colors = np.stack((brightness // 3, brightness // 3, brightness // 2), axis=1)
+        return screen_x[shown].astype(int), screen_y[shown].astype(int), depth[shown], colors
+    
+    def draw(self, screen, camera_pos, basis, viewport=DEFAULT_VIEWPORT):
+        x, y, _, colors = self.project(camera_pos, basis, viewport)
+        plot_points(screen, x, y, colors, DOT_STAMP)
 
 # Прицел
 class Crosshair:
@@ -315,274 +892,1611 @@ class Crosshair:
         self.size = 20
     
     def draw(self, screen):
-        center_x, center_y = WIDTH // 2, HEIGHT // 2
+        center_x, center_y = screen.get_width() // 2, screen.get_height() // 2
         # Простой пиксельный прицел
         pygame.draw.line(screen, RED, (center_x - self.size, center_y), (center_x + self.size, center_y), 2)
         pygame.draw.line(screen, RED, (center_x, center_y - self.size), (center_x, center_y + self.size), 2)
         pygame.draw.circle(screen, RED, (center_x, center_y), 3, 1)
 
-# Основная игра от первого лица
-class Game:
+# Шрифты и неизменные поверхности: создаются при первом запросе и живут до выхода
+class Resources:
     def __init__(self):
+        self.fonts = {}
+        self.surfaces = {}
+    
+    def font(self, size, name=None):
+        font = self.fonts.get((name, size))
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self.fonts[(name, size)] = pygame.font.Font(name, size)
+        return font
+    
+    # make() вызывается только при первом запросе ключа
+    def surface(self, key, make):
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = make()
+        return surface
+
+RESOURCES = Resources()
+
+# Сколько последних кадров хранит профилировщик
+PROFILE_HISTORY = 600
+
+# Как часто (в кадрах) обновлять текст оверлея профилировщика
+PROFILE_OVERLAY_PERIOD = 30
+
+# Замер одной стадии кадра: время складывается, если стадия идёт несколько раз
+class StageTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        current = self.profiler.current
+        current[self.name] = current.get(self.name, 0.0) + elapsed
+
+# Профилировщик кадра: таймеры стадий и счётчики в кольцевых буферах
+class FrameProfiler:
+    def __init__(self, history=PROFILE_HISTORY):
+        self.history = history
+        self.frames = 0
+        self.samples = {}  # имя -> кольцевой буфер значений по кадрам
+        self.current = {}
+        self.timers = {}
+        self.show_overlay = False
+        self.overlay_lines = []
+        self.font = None
+        self.frame_start = 0.0
+        self.blocks_start = 0
+        
+        # Сборки мусора за кадр считаем через колбэк gc
+        self.gc_collections = 0
+        gc.callbacks.append(self.on_gc)
+    
+    def on_gc(self, phase, info):
+        if phase == "start":
+            self.gc_collections += 1
+    
+    # Колбэк gc держит профилировщик живым: без close он считал бы сборки до конца процесса
+    def close(self):
+        if self.on_gc in gc.callbacks:
+            gc.callbacks.remove(self.on_gc)
+    
+    def stage(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = StageTimer(self, name)
+        return timer
+    
+    def count(self, name, value):
+        self.current[name] = value
+    
+    def begin_frame(self):
+        self.current = {}
+        self.gc_collections = 0
+        self.blocks_start = sys.getallocatedblocks()
+        self.frame_start = time.perf_counter()
+    
+    def end_frame(self):
+        current = self.current
+        current["frame"] = (time.perf_counter() - self.frame_start) * 1000
+        # Чистый прирост занятых блоков памяти за кадр, а не число выделений: созданное и освобождённое
+        # внутри кадра сюда не попадает
+        current["net_blocks"] = sys.getallocatedblocks() - self.blocks_start
+        current["gc_collections"] = self.gc_collections
+        
+        # Стадии, не выполнявшиеся в кадре, остаются NaN и не входят в перцентили
+        slot = self.frames % self.history
+        for ring in self.samples.values():
+            ring[slot] = np.nan
+        for name, value in current.items():
+            ring = self.samples.get(name)
+            if ring is None:
+                ring = self.samples[name] = np.full(self.history, np.nan)
+            ring[slot] = value
+        self.frames += 1
+    
+    def ordered(self, name):
+        # Значения по порядку кадров, от старых к новым
+        ring = self.samples[name]
+        if self.frames <= self.history:
+            return ring[:self.frames]
+        slot = self.frames % self.history
+        return np.concatenate((ring[slot:], ring[:slot]))
+    
+    def percentiles(self, name):
+        values = self.ordered(name)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return (0.0, 0.0, 0.0)
+        return tuple(np.percentile(values, (50, 95, 99)).tolist())
+    
+    def summary(self):
+        return {name: dict(zip(("p50", "p95", "p99"), self.percentiles(name))) for name in self.samples}
+    
+    def export(self, path):
+        # CSV: строка на кадр; JSON: перцентили и сырые значения
+        names = sorted(self.samples)
+        first = max(0, self.frames - self.history)
+        columns = [self.ordered(name) for name in names]
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["index"] + names)
+                for i, row in enumerate(zip(*[column.tolist() for column in columns])):
+                    writer.writerow([first + i] + ["" if math.isnan(v) else round(v, 4) for v in row])
+        else:
+            data = {
+                "frames": self.frames,
+                "first_frame": first,
+                "summary": self.summary(),
+                "samples": {name: [None if math.isnan(v) else v for v in column.tolist()]
+                            for name, column in zip(names, columns)}
+            }
+            with open(path, "w") as f:
+                json.dump(data, f, indent=1)
+    
+    def draw_overlay(self, screen):
+        if not self.show_overlay or not self.frames:
+            return
+        
+        if self.font is None:
+            self.font = RESOURCES.font(20)
+        if not self.overlay_lines or self.frames % PROFILE_OVERLAY_PERIOD == 0:
+            rows = [("", "p50", "p95", "p99")]
+            for name in sorted(self.samples):
+                rows.append((name,) + tuple(f"{value:.2f}" for value in self.percentiles(name)))
+            self.overlay_lines = [[self.font.render(text, True, GREEN) for text in row] for row in rows]
+        
+        # Таблица в правом верхнем углу: имя и три столбца, выравнивание по правому краю
+        column = 60
+        name_width = max(row[0].get_width() for row in self.overlay_lines)
+        line_height = self.overlay_lines[0][1].get_height()
+        left = screen.get_width() - 10 - name_width - 3 * column
+        screen.fill(BLACK, (left - 5, 5, name_width + 3 * column + 10, line_height * len(self.overlay_lines) + 10))
+        for i, row in enumerate(self.overlay_lines):
+            y = 10 + i * line_height
+            right = left + name_width
+            for cell in row:
+                screen.blit(cell, (right - cell.get_width(), y))
+                right += column
+
+# Заглушка профилировщика: ничего не замеряет
+class NullProfiler:
+    def stage(self, name):
+        return NULL_STAGE
+    
+    def count(self, name, value):
+        pass
+
+NULL_STAGE = contextlib.nullcontext()
+NULL_PROFILER = NullProfiler()
+
+# Снимок состояния для отрисовки: то, что читают Renderer и Hud, без ссылок на живую симуляцию
+Snapshot = collections.namedtuple("Snapshot", "tick player enemies balls wave game_over")
+
+# Полное состояние симуляции для перемотки и контрольных точек.
+# counters - целые счётчики (STATE_COUNTERS), pose - позиция и углы игрока, rng - состояние генератора
+SavedState = collections.namedtuple("SavedState", "tick seed balance counters pose rng enemies balls")
+STATE_COUNTERS = ("wave", "wave_start_tick", "kills", "kill_ticks", "game_over", "enemy_hits", "player_hits",
+                  "health", "score", "level")
+
+# Состояние игры без окна и рендеринга
+class Simulation:
+    def __init__(self, seed=None, balance=DEFAULT_BALANCE):
+        # Вся случайность игры идёт через собственный генератор
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.balance = balance
+        self.tick = 0
+        self.profiler = NULL_PROFILER
+        # Прицеливание отбития идёт по экрану игрока
+        self.viewport = DEFAULT_VIEWPORT
+        self.reset()
+    
+    def reset(self):
         self.player = Player()
-        self.enemies = []
-        self.player_balls = []
-        self.enemy_balls = []
-        self.bounced_balls = []
-        self.crosshair = Crosshair()
-        self.font = pygame.font.Font(None, 36)
-        self.small_font = pygame.font.Font(None, 24)
+        self.enemies = EnemyPool()
+        self.balls = BallPool()
+        self.grid = SpatialHash()
         self.game_over = False
         self.wave = 1
-        self.clock = pygame.time.Clock()
-        self.spawn_enemies()
         
-        # Блокировка мыши в центре экрана
-        pygame.mouse.set_visible(False)
-        pygame.event.set_grab(True)
+        # Статистика: убитые враги и сумма их времени жизни в тиках
+        self.kills = 0
+        self.kill_ticks = 0
+        
+        # Попадания за последний тик: шаров по врагам и по игроку
+        self.enemy_hits = 0
+        self.player_hits = 0
+        self.spawn_enemies()
     
     def spawn_enemies(self):
-        self.enemies = []
-        enemy_count = 3 + self.wave
+        self.enemies = EnemyPool()
+        self.wave_start_tick = self.tick
+        enemy_count = self.balance.wave_enemies + self.wave * self.balance.enemies_per_wave
         
         for i in range(enemy_count):
             angle = (i / enemy_count) * math.pi * 2
-            radius = 20 + random.randint(10, 30)
+            radius = 20 + self.rng.randint(10, 30)
             x = math.cos(angle) * radius
             z = math.sin(angle) * radius + 30
-            y = random.randint(-5, 5)
+            y = self.rng.randint(-5, 5)
             
-            self.enemies.append(Enemy(Vector3(x, y, z), self.player.level))
+            self.enemies.spawn((x, y, z), self.player.level, self.rng, self.balance)
     
-    def handle_events(self):
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return False
-            
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    return False
-                if event.key == pygame.K_SPACE and self.game_over:
-                    self.__init__()
-                if event.key == pygame.K_f:
-                    # Выстрел
-                    forward, _, _ = self.player.get_camera_vectors()
-                    self.player_balls.append(PlayerBall(self.player.position, forward))
-            
-            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                # Выстрел при клике
-                forward, _, _ = self.player.get_camera_vectors()
-                self.player_balls.append(PlayerBall(self.player.position, forward))
-                
-                # Проверка отбития вражеских шаров (по прицелу)
-                for ball in self.enemy_balls[:]:
-                    # Проецируем шар на экран
-                    forward, right, up = self.player.get_camera_vectors()
-                    cam_relative = ball.position - self.player.position
-                    z = cam_relative.dot(forward)
-                    
-                    if z <= 0.1:
-                        continue
-                    
-                    x = cam_relative.dot(right)
-                    y = cam_relative.dot(up)
-                    
-                    scale = 400 / z
-                    screen_x = WIDTH // 2 + x * scale
-                    screen_y = HEIGHT // 2 - y * scale
-                    
-                    distance = math.sqrt((screen_x - WIDTH//2)**2 + (screen_y - HEIGHT//2)**2)
-                    ball_radius = max(2, int(ball.radius * scale))
-                    
-                    if distance < ball_radius + 10:  # Область прицела
-                        self.enemy_balls.remove(ball)
-                        if self.enemies:
-                            closest_enemy = min(self.enemies, 
-                                              key=lambda e: (e.position - ball.position).length())
-                            self.bounced_balls.append(BouncedBall(ball.position, closest_enemy.position))
-        
-        # Обработка вращения камеры
-        mouse_rel = pygame.mouse.get_rel()
-        self.player.rotate(mouse_rel)
+    def fire(self):
+        forward, _, _ = self.player.get_camera_vectors()
+        position = self.player.position
+        self.balls.spawn((position.x, position.y, position.z), (forward.x, forward.y, forward.z), BALL_PLAYER)
+    
+    def deflect(self):
+        # Отбиваем вражеские шары под прицелом: выбор, удаление и новые шары - пачками
+        balls = self.balls
+        picked = pick_balls(balls, BALL_ENEMY, self.player.position.as_tuple(), self.player.get_camera_basis(),
+                            self.viewport)
+        balls.kill(picked)
         
-        return True
+        if len(picked) and self.enemies:
+            # Каждый отбитый шар летит в ближайшего к нему врага
+            positions = balls.positions[picked]
+            centers = self.enemies.positions[:self.enemies.count]
+            targets = centers[self.nearest_enemies(positions, centers)]
+            balls.spawn_many(positions, targets - positions, BALL_BOUNCED)
+        
+        balls.compact()
     
-    def update(self):
-        if self.game_over:
+    def nearest_enemies(self, points, centers):
+        if len(points) * len(centers) <= BRUTE_FORCE_PAIRS:
+            return nearest_points(points, centers)
+        
+        # Ячейка порядка среднего расстояния между врагами
+        cell_size = max(1.0, np.ptp(centers, axis=0).max() / np.cbrt(len(centers)))
+        self.grid.build(centers, cell_size)
+        return self.grid.nearest(points, centers)
+    
+    def collide_enemies(self):
+        # Столкновения с врагами шаров всех типов, ранящих врагов
+        balls = self.balls
+        enemies = self.enemies
+        indices = balls.live_indices_of(ENEMY_HITTERS)
+        if not len(indices) or not enemies:
             return
         
-        dt = self.clock.tick(60) / 1000.0  # Delta time в секундах
+        # Широкая фаза: только пары шар-враг из соседних ячеек сетки
+        centers = enemies.positions[:enemies.count]
+        sizes = enemies.sizes[:enemies.count] / 2
+        if len(indices) * len(centers) <= BRUTE_FORCE_PAIRS:
+            rows, targets = np.divmod(np.arange(len(indices) * len(centers)), len(centers))
+        else:
+            self.grid.build(centers, sizes.max() + balls.radii[indices].max())
+            rows, targets = self.grid.query_pairs(balls.positions[indices])
         
-        # Движение игрока
-        keys = pygame.key.get_pressed()
-        self.player.move(keys, dt)
+        # Узкая фаза: сравниваем квадраты расстояний
+        offset = balls.positions[indices[rows]] - centers[targets]
+        reach = balls.radii[indices[rows]] + sizes[targets]
+        hit = np.einsum("ij,ij->i", offset, offset) < reach * reach
+        rows = rows[hit]
+        targets = targets[hit]
+        if not len(rows):
+            return
         
-        # Обновление врагов
-        for enemy in self.enemies:
-            enemy.update(self.player.position, dt)
-            
-            if enemy.should_shoot():
-                # Враг стреляет в игрока
-                self.enemy_balls.append(EnemyBall(enemy.position, self.player.position))
-                enemy.reset_shoot_timer()
-        
-        # Обновление шаров игрока
-        for ball in self.player_balls[:]:
-            ball.update(dt)
-            if ball.is_off_screen(self.player.position):
-                self.player_balls.remove(ball)
+        # Каждый шар попадает в первого ещё живого врага; урон и очки - из таблиц по типу шара
+        kinds = balls.kinds[indices].tolist()
+        order = np.lexsort((targets, rows))
+        killed = set()
+        used = set()
+        for row, j in zip(rows[order].tolist(), targets[order].tolist()):
+            if row in used or j in killed:
                 continue
+            used.add(row)
+            kind = kinds[row]
+            enemies.health[j] -= BALL_ENEMY_DAMAGE[kind]
+            balls.kill(indices[row])
+            self.enemy_hits += 1
             
-            # Проверка столкновений с врагами
-            for enemy in self.enemies[:]:
-                distance = (ball.position - enemy.position).length()
-                if distance < ball.radius + enemy.size/2:
-                    enemy.health -= 1
-                    if ball in self.player_balls:
-                        self.player_balls.remove(ball)
-                    
-                    if enemy.health <= 0:
-                        self.enemies.remove(enemy)
-                        self.player.score += 10 * self.player.level
-                    
-                    break
-        
-        # Обновление вражеских шаров
-        for ball in self.enemy_balls[:]:
-            ball.update(dt)
-            if ball.is_off_screen(self.player.position):
-                self.enemy_balls.remove(ball)
-                continue
+            if enemies.health[j] <= 0:
+                killed.add(j)
+                self.player.score += BALL_KILL_SCORES[kind] * self.player.level
+                self.kills += 1
+                self.kill_ticks += self.tick - self.wave_start_tick
+        
+        if killed:
+            dead = np.zeros(enemies.count, dtype=bool)
+            dead[list(killed)] = True
+            enemies.remove(dead)
+    
+    def collide_player(self, center):
+        # Столкновения с игроком шаров всех типов, ранящих игрока
+        balls = self.balls
+        indices = balls.live_indices_of(PLAYER_HITTERS)
+        offset = balls.positions[indices] - center
+        reach = balls.radii[indices] + PLAYER_RADIUS
+        hit = indices[np.einsum("ij,ij->i", offset, offset) < reach * reach]
+        if len(hit):
+            self.player.health -= int(BALL_PLAYER_DAMAGE[balls.kinds[hit]].sum())
+            self.player_hits += len(hit)
+            balls.kill(hit)
             
-            # Проверка столкновений с игроком
-            distance = (ball.position - self.player.position).length()
-            if distance < ball.radius + 2:  # Маленький радиус столкновения с игроком
-                self.player.health -= 1
-                self.enemy_balls.remove(ball)
-                
-                if self.player.health <= 0:
-                    self.game_over = True
-                    pygame.mouse.set_visible(True)
-                    pygame.event.set_grab(False)
-        
-        # Обновление отскочивших шаров
-        for ball in self.bounced_balls[:]:
-            ball.update(dt)
-            if ball.is_off_screen(self.player.position):
-                self.bounced_balls.remove(ball)
-                continue
+            if self.player.health <= 0:
+                self.game_over = True
+    
+    def step(self, dt, inputs=IDLE_INPUT):
+        self.tick += 1
+        self.enemy_hits = 0
+        self.player_hits = 0
+        buttons = inputs.buttons
+        profiler = self.profiler
+        
+        with profiler.stage("input"):
+            # Обработка вращения камеры
+            self.player.rotate((inputs.mouse_dx, inputs.mouse_dy))
+            
+            if self.game_over:
+                if buttons & INPUT_RESTART:
+                    self.reset()
+                return
+            
+            if buttons & INPUT_FIRE:
+                self.fire()
+            if buttons & INPUT_DEFLECT:
+                self.deflect()
             
-            # Проверка столкновений с врагами
-            for enemy in self.enemies[:]:
-                distance = (ball.position - enemy.position).length()
-                if distance < ball.radius + enemy.size/2:
-                    enemy.health -= 2
-                    if ball in self.bounced_balls:
-                        self.bounced_balls.remove(ball)
-                    
-                    if enemy.health <= 0:
-                        self.enemies.remove(enemy)
-                        self.player.score += 15 * self.player.level
-                    
-                    break
+            # Движение игрока
+            self.player.move(buttons, dt)
+            player_pos = self.player.position
+        
+        center = np.array((player_pos.x, player_pos.y, player_pos.z))
+        
+        with profiler.stage("enemies"):
+            # Системы врагов: покачивание, движение к игроку, таймеры выстрелов
+            enemies = self.enemies
+            enemies.wobble(dt)
+            enemies.approach(center, dt)
+            shooters = enemies.shooters(dt)
+            if len(shooters):
+                # Враги стреляют в игрока
+                positions = enemies.positions[shooters]
+                self.balls.spawn_many(positions, center - positions, BALL_ENEMY)
+        
+        with profiler.stage("balls"):
+            # Движение всех шаров и удаление улетевших
+            balls = self.balls
+            balls.integrate(dt)
+            balls.cull(center, BALL_MAX_DISTANCE)
+        
+        with profiler.stage("collide_enemies"):
+            # Шары игрока и отбитые шары против врагов
+            self.collide_enemies()
+        
+        with profiler.stage("collide_player"):
+            # Вражеские шары против игрока
+            self.collide_player(center)
+        
+        balls.compact()
         
         # Проверка завершения волны
         if not self.enemies:
             self.wave += 1
             self.player.level += 1
             self.spawn_enemies()
+        
+        profiler.count("enemies_count", len(self.enemies))
+        profiler.count("balls_count", len(balls))
+    
+    def snapshot(self):
+        return Snapshot(self.tick, self.player.copy(), self.enemies.snapshot(), self.balls.snapshot(), self.wave,
+                        self.game_over)
+    
+    # Состояние целиком: числа упакованы в два массива, пулы - копии занятых строк, генератор - getstate()
+    def save_state(self):
+        player = self.player
+        counters = np.array((self.wave, self.wave_start_tick, self.kills, self.kill_ticks, self.game_over,
+                             self.enemy_hits, self.player_hits, player.health, player.score, player.level),
+                            dtype=np.int64)
+        pose = np.array(player.position.as_tuple() + (player.yaw, player.pitch))
+        return SavedState(self.tick, self.seed, self.balance, counters, pose, self.rng.getstate(),
+                          self.enemies.snapshot(), self.balls.snapshot())
+    
+    # Продолжение с сохранённого состояния даёт те же тики, что и без остановки
+    def restore_state(self, state):
+        (self.wave, self.wave_start_tick, self.kills, self.kill_ticks, game_over, self.enemy_hits, self.player_hits,
+         health, score, level) = state.counters.tolist()
+        self.tick = state.tick
+        self.seed = state.seed
+        self.balance = state.balance
+        self.game_over = bool(game_over)
+        self.rng.setstate(state.rng)
+        
+        player = self.player = Player()
+        x, y, z, player.yaw, player.pitch = state.pose.tolist()
+        player.position = Vector3(x, y, z)
+        player.health = health
+        player.score = score
+        player.level = level
+        
+        self.enemies.load(state.enemies)
+        self.balls.load(state.balls)
+
+def lerp(a, b, alpha):
+    return a + (b - a) * alpha
+
+# Строки прошлого снимка пула для строк текущего по номерам: (маска найденных, их строки в прошлом)
+def match_ids(previous_ids, ids):
+    order = np.argsort(previous_ids)
+    sorted_ids = previous_ids[order]
+    slots = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    matched = sorted_ids[slots] == ids
+    return matched, order[slots[matched]]
+
+# Копия снимка пула с позициями между прошлым и текущим снимками
+def interpolate_positions(previous, current, alpha):
+    pool = copy.copy(current)
+    pool.positions = current.positions.copy()
+    if previous.count:
+        matched, rows = match_ids(previous.ids, pool.ids)
+        pool.positions[matched] = lerp(previous.positions[rows], pool.positions[matched], alpha)
+    return pool
+
+# Промежуточный кадр между двумя тиками: alpha = 0 - предыдущий снимок, 1 - текущий.
+# Объекты сопоставляются по номерам; новые рисуются на текущем месте
+def interpolate_snapshots(previous, current, alpha):
+    # Позиция - на месте в копии текущей: (текущая - прошлая) * alpha + прошлая, как в lerp
+    player = current.player.copy()
+    position = player.position
+    position -= previous.player.position
+    position *= alpha
+    position += previous.player.position
+    player.yaw = lerp(previous.player.yaw, current.player.yaw, alpha)
+    player.pitch = lerp(previous.player.pitch, current.player.pitch, alpha)
+    
+    enemies = interpolate_positions(previous.enemies, current.enemies, alpha)
+    balls = interpolate_positions(previous.balls, current.balls, alpha)
+    return current._replace(player=player, enemies=enemies, balls=balls)
+
+# Симуляция в своём потоке: тикает с шагом dt по часам, ввод копится между тиками,
+# после каждого тика публикуются два последних снимка для интерполяции
+class SimulationThread:
+    def __init__(self, sim, dt=FIXED_DT, recorder=None, telemetry=None, history=None):
+        self.sim = sim
+        self.dt = dt
+        self.recorder = recorder
+        self.telemetry = telemetry
+        self.history = history
+        self.profiler = NULL_PROFILER
+        self.lock = threading.Lock()
+        self.held_buttons = 0
+        self.pending_buttons = 0
+        self.mouse_dx = 0
+        self.mouse_dy = 0
+        
+        # Действия над симуляцией из других потоков: выполняются здесь между тиками
+        self.calls = queue.SimpleQueue()
+        
+        # (предыдущий снимок, текущий, время тика текущего); заменяется одним присваиванием
+        snapshot = sim.snapshot()
+        self.published = (snapshot, snapshot, time.perf_counter())
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+    
+    def start(self):
+        self.running = True
+        self.thread.start()
+    
+    def stop(self):
+        self.running = False
+        self.thread.join()
+    
+    # Ввод кадра: удерживаемые кнопки заменяются, нажатия и движение мыши копятся до тика
+    def add_input(self, held, buttons, mouse_dx, mouse_dy):
+        with self.lock:
+            self.held_buttons = held
+            self.pending_buttons |= buttons
+            self.mouse_dx += mouse_dx
+            self.mouse_dy += mouse_dy
+    
+    def take_input(self):
+        with self.lock:
+            inputs = TickInput(self.held_buttons | self.pending_buttons, self.mouse_dx, self.mouse_dy)
+            self.pending_buttons = 0
+            self.mouse_dx = 0
+            self.mouse_dy = 0
+        return inputs
     
-    def draw_3d_environment(self, screen):
+    def call(self, function):
+        self.calls.put(function)
+    
+    # Очередь вызовов; после них интерполировать не от чего - оба снимка новые
+    def run_calls(self):
+        if self.calls.empty():
+            return
+        while not self.calls.empty():
+            function = self.calls.get()
+            try:
+                function()
+            except Exception:
+                # Сбой одного вызова не должен останавливать тики
+                traceback.print_exc()
+        snapshot = self.sim.snapshot()
+        self.published = (snapshot, snapshot, time.perf_counter())
+    
+    def run(self):
+        next_tick = time.perf_counter() + self.dt
+        while self.running:
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+                continue
+            
+            # Сильно отстали (пауза, перегрузка): не догоняем больше MAX_STEPS_PER_FRAME тиков
+            next_tick = max(next_tick, time.perf_counter() - MAX_STEPS_PER_FRAME * self.dt)
+            
+            self.run_calls()
+            inputs = self.take_input()
+            if self.recorder:
+                self.recorder.write(inputs)
+            self.profiler.begin_frame()
+            self.sim.step(self.dt, inputs)
+            self.profiler.end_frame()
+            if self.telemetry:
+                self.telemetry.record(self.sim)
+            if self.history:
+                self.history.record(self.sim)
+            
+            self.published = (self.published[1], self.sim.snapshot(), next_tick)
+            next_tick += self.dt
+    
+    # Кадр на момент now: интерполяция между двумя последними тиками
+    def frame(self, now):
+        previous, current, tick_time = self.published
+        alpha = min(1.0, max(0.0, (now - tick_time) / self.dt))
+        return interpolate_snapshots(previous, current, alpha)
+
+# Строки интерфейса: шаблон и позиция
+HUD_LINES = (
+    ("Здоровье: {}/20", (10, 10)),
+    ("Счет: {}", (10, 35)),
+    ("Уровень: {}", (10, 60)),
+    ("Волна: {}", (10, 85)),
+    ("Врагов: {}", (10, 110))
+)
+
+HELP_TEXT = "WASD: движение, Q/E: вверх/вниз, ЛКМ: стрелять/отбивать, ESC: выход"
+
+# Интерфейс: текст перерисовывается только при изменении значений
+class Hud:
+    def __init__(self, resources=RESOURCES):
+        self.resources = resources
+        self.lines = [(None, None)] * len(HUD_LINES)  # (значение, поверхность) по строкам
+    
+    # Неизменные элементы рисуются один раз, при первом показе
+    def text(self, text, size, color):
+        key = ("text", text, size, color)
+        return self.resources.surface(key, lambda: self.resources.font(size).render(text, True, color))
+    
+    @staticmethod
+    def make_overlay(size):
+        overlay = pygame.Surface(size, pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 200))
+        return overlay
+    
+    # Значения строк интерфейса: пока они те же, интерфейс не меняется
+    @staticmethod
+    def values(sim):
+        return (sim.player.health, sim.player.score, sim.player.level, sim.wave, len(sim.enemies))
+    
+    def draw(self, screen, sim):
+        small_font = self.resources.font(24)
+        for i, ((template, position), value) in enumerate(zip(HUD_LINES, self.values(sim))):
+            cached_value, text = self.lines[i]
+            if text is None or cached_value != value:
+                text = small_font.render(template.format(value), True, WHITE)
+                self.lines[i] = (value, text)
+            screen.blit(text, position)
+        
+        # Подсказки
+        width, height = screen.get_size()
+        help_text = self.text(HELP_TEXT, 24, GRAY)
+        screen.blit(help_text, (width // 2 - help_text.get_width() // 2, height - 30))
+        
+        if sim.game_over:
+            game_over_text = self.text("ИГРА ОКОНЧЕНА!", 36, RED)
+            restart_text = self.text("Нажмите ПРОБЕЛ для перезапуска", 36, WHITE)
+            overlay = self.resources.surface(("game_over_overlay", (width, height)), lambda: self.make_overlay((width, height)))
+            screen.blit(overlay, (0, 0))
+            screen.blit(game_over_text, (width // 2 - game_over_text.get_width() // 2, height // 2 - 50))
+            screen.blit(restart_text, (width // 2 - restart_text.get_width() // 2, height // 2 + 10))
+
+# Грязные прямоугольники: экран делится на плитки, на экран уходят только задетые за кадр
+DIRTY_TILE = 32
+
+# Плитки, задетые прямоугольниками (N, 4) вида x0, y0, x1, y1: разностный массив вместо цикла
+def dirty_tiles(rects, size):
+    columns = -(-size[0] // DIRTY_TILE)
+    rows = -(-size[1] // DIRTY_TILE)
+    diff = np.zeros((rows + 1, columns + 1), dtype=np.int32)
+    if len(rects):
+        x0 = np.clip(np.floor(rects[:, 0] / DIRTY_TILE), 0, columns).astype(int)
+        y0 = np.clip(np.floor(rects[:, 1] / DIRTY_TILE), 0, rows).astype(int)
+        x1 = np.clip(np.ceil(rects[:, 2] / DIRTY_TILE), 0, columns).astype(int)
+        y1 = np.clip(np.ceil(rects[:, 3] / DIRTY_TILE), 0, rows).astype(int)
+        keep = (x1 > x0) & (y1 > y0)
+        x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+        np.add.at(diff, (y0, x0), 1)
+        np.add.at(diff, (y0, x1), -1)
+        np.add.at(diff, (y1, x0), -1)
+        np.add.at(diff, (y1, x1), 1)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:rows, :columns] > 0
+
+# Плитки -> прямоугольники: по одному на каждый непрерывный отрезок строки плиток
+def tile_runs(tiles, size):
+    edges = np.diff(np.pad(tiles.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    row, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    bounds = pygame.Rect((0, 0), size)
+    return [pygame.Rect(x0 * DIRTY_TILE, y * DIRTY_TILE, (x1 - x0) * DIRTY_TILE, DIRTY_TILE).clip(bounds)
+            for y, x0, x1 in zip(row.tolist(), start.tolist(), end.tolist())]
+
+# Отрисовка состояния симуляции на поверхность
+class Renderer:
+    def __init__(self, screen, floor_extent=20, dirty_rects=False, viewport=None):
+        # Сцена проецируется в разрешении внутренней отрисовки; интерфейс рисуется на экране
+        output = viewport or Viewport(*screen.get_size())
+        self.viewport = output.scaled()
+        self.scaled = self.viewport is not output
+        self.display = screen
+        self.screen = screen
+        if self.scaled or dirty_rects:
+            self.screen = pygame.Surface(self.viewport.size, 0, screen)
+        
+        self.profiler = NULL_PROFILER
+        self.floor = FloorGrid(floor_extent)
+        self.ball_sprites = BallSprites(screen)
+        self.crosshair = Crosshair()
+        self.hud = Hud()
+        
+        # Частичная перерисовка: сцена рисуется в свою поверхность поверх закэшированного фона,
+        # интерфейс - в прозрачный слой, на экран копируются только изменившиеся плитки
+        self.dirty_rects = dirty_rects
+        if dirty_rects:
+            self.background = self.screen.copy()
+            self.overlay = pygame.Surface(screen.get_size(), pygame.SRCALPHA)
+            self.overlay_key = None
+            self.camera_key = None
+            self.tiles = dirty_tiles((), self.viewport.size)
+            self.rects = []
+    
+    # Следующий кадр режима частичной перерисовки уйдёт на экран целиком
+    def invalidate(self):
+        if self.dirty_rects:
+            self.camera_key = None
+    
+    # Прямоугольники (x0, y0, x1, y1), задетые объектами кадра
+    def track(self, x0, y0, x1, y1):
+        if self.dirty_rects:
+            self.rects.append(np.stack((x0, y0, x1, y1), axis=1))
+    
+    def draw_3d_environment(self, sim, camera_pos, basis):
         # Рисуем простой пол
-        forward, right, up = self.player.get_camera_vectors()
-        
-        # Рисуем сетку пола
-        grid_size = 10
-        for i in range(-20, 21):
-            for j in range(-20, 21):
-                point = Vector3(i * grid_size, -5, j * grid_size)
-                cam_relative = point - self.player.position
-                z = cam_relative.dot(forward)
-                
-                if z <= 0.1:
-                    continue
-                
-                x = cam_relative.dot(right)
-                y = cam_relative.dot(up)
-                
-                scale = 400 / z
-                screen_x = WIDTH // 2 + x * scale
-                screen_y = HEIGHT // 2 - y * scale
-                
-                if 0 <= screen_x < WIDTH and 0 <= screen_y < HEIGHT:
-                    brightness = max(0, min(255, int(255 * (1 - z/200))))
-                    color = (brightness//3, brightness//3, brightness//2)
-                    pygame.draw.circle(screen, color, (int(screen_x), int(screen_y)), 1)
+        self.floor.draw(self.screen, camera_pos, basis, self.viewport)
     
-    def draw(self):
+    def draw(self, sim):
+        if self.dirty_rects:
+            return self.draw_dirty(sim)
+        
+        screen = self.screen
+        profiler = self.profiler
         screen.fill(BLACK)
         
-        # Получаем векторы камеры
-        forward, right, up = self.player.get_camera_vectors()
+        # Базис камеры: общий для всей проекции кадра
+        camera_pos = sim.player.position.as_tuple()
+        basis = sim.player.get_camera_basis()
+        
+        with profiler.stage("floor"):
+            # Рисуем 3D окружение
+            self.draw_3d_environment(sim, camera_pos, basis)
         
-        # Рисуем 3D окружение
-        self.draw_3d_environment(screen)
+        with profiler.stage("entities"):
+            # Рисуем все 3D объекты: до отрисовки доходят только прошедшие отсечение
+            self.draw_entities(sim, camera_pos, basis)
+        
+        with profiler.stage("hud"):
+            self.present_scene()
+            self.draw_hud(self.display, sim)
+    
+    # Сцена из внутренней поверхности на экран: копией или одним масштабированием
+    def present_scene(self):
+        if self.screen is self.display:
+            return
+        if self.scaled:
+            pygame.transform.scale(self.screen, self.display.get_size(), self.display)
+        else:
+            self.display.blit(self.screen, (0, 0))
+    
+    # Прямоугольник внутренней поверхности -> покрывающий его прямоугольник экрана
+    def output_rect(self, rect):
+        scale_x = self.display.get_width() / self.screen.get_width()
+        scale_y = self.display.get_height() / self.screen.get_height()
+        left = math.floor(rect.left * scale_x) - 1
+        top = math.floor(rect.top * scale_y) - 1
+        right = math.ceil(rect.right * scale_x) + 1
+        bottom = math.ceil(rect.bottom * scale_y) + 1
+        return pygame.Rect(left, top, right - left, bottom - top).clip(self.display.get_rect())
+    
+    # Кадр с частичной перерисовкой: возвращает прямоугольники экрана для pygame.display.update
+    def draw_dirty(self, sim):
+        screen = self.screen
+        profiler = self.profiler
+        size = screen.get_size()
+        camera_pos = sim.player.position.as_tuple()
+        basis = sim.player.get_camera_basis()
+        
+        # Сдвиг или поворот камеры меняет весь пол, смена интерфейса - его слой: кадр уходит целиком.
+        # Затемнение окончания игры тоже рисуется по полному кадру
+        camera_key = (camera_pos, sim.player.yaw, sim.player.pitch)
+        overlay_key = (self.hud.values(sim), sim.game_over)
+        full = camera_key != self.camera_key or overlay_key != self.overlay_key or sim.game_over
+        
+        with profiler.stage("floor"):
+            if full:
+                screen.fill(BLACK)
+                self.draw_3d_environment(sim, camera_pos, basis)
+                self.background.blit(screen, (0, 0))
+            else:
+                self.restore_background(sim, camera_pos, basis)
+        
+        with profiler.stage("entities"):
+            self.rects = []
+            self.draw_entities(sim, camera_pos, basis)
+            tiles = dirty_tiles(np.concatenate(self.rects) if self.rects else (), size)
+        
+        with profiler.stage("hud"):
+            if overlay_key != self.overlay_key and not self.scaled:
+                self.overlay.fill((0, 0, 0, 0))
+                self.draw_hud(self.overlay, sim)
+            
+            if full:
+                self.present_scene()
+                self.draw_hud(self.display, sim)
+                rects = [self.display.get_rect()]
+            elif self.scaled:
+                # Масштабированный кадр собирается целиком, но на экран уходят только плитки
+                self.present_scene()
+                self.draw_hud(self.display, sim)
+                rects = [self.output_rect(rect) for rect in tile_runs(tiles | self.tiles, size)]
+            else:
+                # Плитки с объектами этого и прошлого кадра: новые места и стёртые старые
+                rects = tile_runs(tiles | self.tiles, size)
+                for rect in rects:
+                    self.display.blit(screen, rect, rect)
+                    self.display.blit(self.overlay, rect, rect)
+        
+        self.camera_key = camera_key
+        self.overlay_key = overlay_key
+        self.tiles = tiles
+        return rects
+    
+    # Под объектами прошлого кадра восстанавливается закэшированный фон
+    def restore_background(self, sim, camera_pos, basis):
+        for rect in tile_runs(self.tiles, self.screen.get_size()):
+            self.screen.blit(self.background, rect, rect)
+    
+    def draw_entities(self, sim, camera_pos, basis):
+        self.draw_balls(sim, camera_pos, basis)
+        self.draw_enemies(sim, camera_pos, basis)
+    
+    def draw_lod_points(self, points, colors, camera_pos, basis):
+        # Далёкие объекты меньше пикселя: одна точка вместо полной отрисовки
+        screen_x, screen_y, _, depth, visible = project_points(points, camera_pos, basis, self.viewport)
+        x = screen_x[visible].astype(int)
+        y = screen_y[visible].astype(int)
+        self.track(x, y, x + 1, y + 1)
+        self.plot_lod_points(x, y, depth[visible], colors[visible])
+    
+    def plot_lod_points(self, x, y, depth, colors):
+        plot_points(self.screen, x, y, colors)
+    
+    # Шары, прошедшие отсечение: экранные центры, радиусы, глубины и типы; далёкие рисуются точками
+    def visible_balls(self, sim, camera_pos, basis):
+        balls = sim.balls
+        n = balls.count
+        positions = balls.positions[:n]
+        kinds = balls.kinds[:n]
+        drawn, tiny = cull_spheres(positions, balls.radii[:n], camera_pos, basis, self.viewport)
+        self.profiler.count("balls_culled", n - int(np.count_nonzero(drawn)) - int(np.count_nonzero(tiny)))
+        self.profiler.count("balls_lod", int(np.count_nonzero(tiny)))
+        if tiny.any():
+            self.draw_lod_points(positions[tiny], BALL_COLOR_ARRAY[kinds[tiny]], camera_pos, basis)
         
-        # Рисуем все 3D объекты
-        for ball in self.player_balls:
-            ball.draw(screen, self.player.position, forward, right, up)
+        screen_x, screen_y, scale, depth, visible = project_points(positions[drawn], camera_pos, basis, self.viewport)
+        draw_radius = np.maximum(2, (balls.radii[:n][drawn] * scale).astype(int))
+        x = screen_x[visible].astype(int)
+        y = screen_y[visible].astype(int)
+        radius = draw_radius[visible]
+        self.track(x - radius, y - radius, x + radius + 1, y + radius + 1)
+        return x, y, radius, depth[visible], kinds[drawn][visible]
+    
+    def draw_balls(self, sim, camera_pos, basis):
+        if not sim.balls.count:
+            return
+        screen_x, screen_y, draw_radius, _, kinds = self.visible_balls(sim, camera_pos, basis)
         
-        for ball in self.enemy_balls:
-            ball.draw(screen, self.player.position, forward, right, up)
+        # Все шары кадра уходят одним вызовом blits; только огромные рисуются напрямую
+        sprites = []
+        large = []
+        for x, y, r, kind in zip(screen_x.tolist(), screen_y.tolist(), draw_radius.tolist(), kinds.tolist()):
+            if r <= SPRITE_MAX_RADIUS:
+                sprites.append((self.ball_sprites.get(kind, r), (x - r, y - r)))
+            else:
+                large.append((x, y, r, kind))
+        self.screen.blits(sprites, False)
         
-        for ball in self.bounced_balls:
-            ball.draw(screen, self.player.position, forward, right, up)
+        for x, y, r, kind in large:
+            draw_ball(self.screen, x, y, r, kind)
+    
+    # Враги, прошедшие отсечение: номера строк пула; далёкие рисуются точками
+    def visible_cubes(self, sim, camera_pos, basis):
+        enemies = sim.enemies
+        n = enemies.count
+        if not n:
+            return np.empty(0, dtype=np.intp)
         
-        for enemy in self.enemies:
-            enemy.draw(screen, self.player.position, forward, right, up)
+        centers = enemies.positions[:n]
+        radii = enemies.sizes[:n] * CUBE_BOUNDING_RADIUS
+        drawn, tiny = cull_spheres(centers, radii, camera_pos, basis, self.viewport)
+        self.profiler.count("enemies_culled", n - int(np.count_nonzero(drawn)) - int(np.count_nonzero(tiny)))
+        self.profiler.count("enemies_lod", int(np.count_nonzero(tiny)))
+        if tiny.any():
+            self.draw_lod_points(centers[tiny], enemies.colors[:n][tiny], camera_pos, basis)
         
+        return np.flatnonzero(drawn)
+    
+    # Видимые грани кубов врагов: цвета граней (N, 6, 3) и результат visible_cube_faces
+    def visible_faces(self, sim, camera_pos, basis):
+        drawn = self.visible_cubes(sim, camera_pos, basis)
+        if not len(drawn):
+            return None
+        enemies = sim.enemies
+        positions = enemies.positions[drawn]
+        points, depth, cube_idx, face_idx = visible_cube_faces(positions, enemies.sizes[drawn], camera_pos, basis,
+                                                               self.viewport)
+        # Контур грани толщиной 2 выходит за её вершины
+        low = points.min(axis=1) - 2
+        high = points.max(axis=1) + 3
+        self.track(low[:, 0], low[:, 1], high[:, 0], high[:, 1])
+        return cube_face_colors(enemies.colors[drawn]), points, depth, cube_idx, face_idx
+    
+    def draw_enemies(self, sim, camera_pos, basis):
+        faces = self.visible_faces(sim, camera_pos, basis)
+        if faces:
+            draw_cube_faces(self.screen, *faces)
+    
+    def draw_hud(self, screen, sim):
         # Рисуем прицел
         self.crosshair.draw(screen)
         
         # Интерфейс
-        health_text = self.small_font.render(f"Здоровье: {self.player.health}/20", True, WHITE)
-        score_text = self.small_font.render(f"Счет: {self.player.score}", True, WHITE)
-        level_text = self.small_font.render(f"Уровень: {self.player.level}", True, WHITE)
-        wave_text = self.small_font.render(f"Волна: {self.wave}", True, WHITE)
-        enemies_text = self.small_font.render(f"Врагов: {len(self.enemies)}", True, WHITE)
-        
-        screen.blit(health_text, (10, 10))
-        screen.blit(score_text, (10, 35))
-        screen.blit(level_text, (10, 60))
-        screen.blit(wave_text, (10, 85))
-        screen.blit(enemies_text, (10, 110))
+        self.hud.draw(screen, sim)
+
+# Отрисовка через программный растеризатор: грани и шары всех объектов сравниваются по глубине попиксельно
+class ZBufferRenderer(Renderer):
+    def __init__(self, screen, floor_extent=20, dirty_rects=False, viewport=None):
+        super().__init__(screen, floor_extent, dirty_rects, viewport)
+        self.depth_buffer = DepthBuffer(self.viewport.size)
+    
+    def draw_3d_environment(self, sim, camera_pos, basis):
+        self.depth_buffer.clear()
+        x, y, depth, colors = self.floor.project(camera_pos, basis, self.viewport)
+        self.depth_buffer.plot(x, y, depth, colors, DOT_STAMP)
+    
+    # Буфер глубины пересобирается каждый кадр и выводится целиком: фон берётся из него же
+    def restore_background(self, sim, camera_pos, basis):
+        self.draw_3d_environment(sim, camera_pos, basis)
+    
+    def draw_entities(self, sim, camera_pos, basis):
+        super().draw_entities(sim, camera_pos, basis)
+        self.depth_buffer.present(self.screen)
+    
+    def plot_lod_points(self, x, y, depth, colors):
+        self.depth_buffer.plot(x, y, depth, colors)
+    
+    def draw_balls(self, sim, camera_pos, basis):
+        if not sim.balls.count:
+            return
+        self.depth_buffer.fill_discs(*self.visible_balls(sim, camera_pos, basis))
+    
+    def draw_enemies(self, sim, camera_pos, basis):
+        faces = self.visible_faces(sim, camera_pos, basis)
+        if not faces:
+            return
+        face_colors, points, depth, cube_idx, face_idx = faces
+        self.depth_buffer.fill_quads(points, depth, face_colors[cube_idx, face_idx])
+
+# Бэкенды отрисовки, выбираются при запуске
+RENDERERS = {
+    "pygame": Renderer,
+    "zbuffer": ZBufferRenderer
+}
+
+# Кольцо перемотки: состояние каждые REWIND_INTERVAL тиков, хранится последних REWIND_STATES
+REWIND_INTERVAL = 30
+REWIND_STATES = 60
+
+class StateHistory:
+    def __init__(self, capacity=REWIND_STATES, interval=REWIND_INTERVAL):
+        self.states = collections.deque(maxlen=capacity)
+        self.interval = interval
+    
+    # После тика; самое старое состояние вытесняется из кольца
+    def record(self, sim):
+        if sim.tick % self.interval == 0:
+            self.states.append(sim.save_state())
+    
+    # Состояние хотя бы на interval тиков раньше tick; более поздние выбрасываются. None - отматывать некуда
+    def rewind(self, tick):
+        while self.states:
+            state = self.states.pop()
+            if state.tick <= tick - self.interval:
+                return state
+        return None
+    
+    def clear(self):
+        self.states.clear()
+
+# Основная игра от первого лица (окно, ввод, часы)
+class Game:
+    def __init__(self, screen, seed=None, recorder=None, profile_path=None, renderer="pygame", telemetry=None,
+                 viewport=None, state_path=None, **renderer_options):
+        self.screen = screen
+        self.viewport = viewport or Viewport(*screen.get_size())
+        self.profiler = FrameProfiler()
+        self.profile_path = profile_path or "profile.csv"
+        self.state_path = state_path or "state.bsta"
+        self.history = StateHistory()
+        self.sim = Simulation(seed)
+        self.sim.profiler = self.profiler
+        self.sim.viewport = self.viewport
+        self.recorder = recorder
+        self.telemetry = telemetry
+        self.renderer = RENDERERS[renderer](screen, viewport=self.viewport, **renderer_options)
+        self.renderer.profiler = self.profiler
+        self.clock = pygame.time.Clock()
+        self.accumulator = 0.0
         
-        # Подсказки
-        help_text = self.small_font.render("WASD: движение, Q/E: вверх/вниз, ЛКМ: стрелять/отбивать, ESC: выход", True, GRAY)
-        screen.blit(help_text, (WIDTH // 2 - help_text.get_width() // 2, HEIGHT - 30))
+        # Ввод, накопленный с прошлого тика
+        self.pending_buttons = 0
+        self.mouse_dx = 0
+        self.mouse_dy = 0
         
-        if self.game_over:
-            overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 200))
-            screen.blit(overlay, (0, 0))
+        self.move_keys = [(getattr(pygame, name), button) for name, button in MOVE_KEYS]
+        self.mouse_grabbed = None
+        self.set_mouse_grab(True)
+    
+    def set_mouse_grab(self, grab):
+        # Блокировка мыши в центре экрана
+        if grab == self.mouse_grabbed:
+            return
+        self.mouse_grabbed = grab
+        pygame.mouse.set_visible(not grab)
+        pygame.event.set_grab(grab)
+    
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    return False
+                if event.key == pygame.K_SPACE and self.sim.game_over:
+                    self.pending_buttons |= INPUT_RESTART
+                if event.key == pygame.K_f:
+                    # Выстрел
+                    self.pending_buttons |= INPUT_FIRE
+                if event.key == pygame.K_F3:
+                    # Оверлей профилировщика
+                    self.profiler.show_overlay = not self.profiler.show_overlay
+                    self.renderer.invalidate()
+                if event.key == pygame.K_F4:
+                    self.export_profile(self.profile_path)
+                if event.key == pygame.K_F5:
+                    self.save_checkpoint()
+                if event.key == pygame.K_F9:
+                    self.load_checkpoint()
+                if event.key == pygame.K_BACKSPACE:
+                    self.rewind()
             
-            game_over_text = self.font.render("ИГРА ОКОНЧЕНА!", True, RED)
-            restart_text = self.font.render("Нажмите ПРОБЕЛ для перезапуска", True, WHITE)
-            screen.blit(game_over_text, (WIDTH // 2 - game_over_text.get_width() // 2, HEIGHT // 2 - 50))
-            screen.blit(restart_text, (WIDTH // 2 - restart_text.get_width() // 2, HEIGHT // 2 + 10))
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                # Выстрел при клике и отбитие шаров по прицелу
+                self.pending_buttons |= INPUT_FIRE | INPUT_DEFLECT
+        
+        # Вращение камеры применяется на ближайшем тике
+        mouse_dx, mouse_dy = pygame.mouse.get_rel()
+        self.mouse_dx += mouse_dx
+        self.mouse_dy += mouse_dy
         
-        pygame.display.flip()
+        return True
+    
+    def held_buttons(self):
+        keys = pygame.key.get_pressed()
+        held = 0
+        for key, button in self.move_keys:
+            if keys[key]:
+                held |= button
+        return held
+    
+    def update(self):
+        # Накопитель времени: симуляция всегда идёт шагами FIXED_DT
+        frame_ms = self.clock.tick(60)
+        self.accumulator += frame_ms / 1000.0
+        self.accumulator = min(self.accumulator, MAX_STEPS_PER_FRAME * FIXED_DT)
+        if self.telemetry:
+            self.telemetry.frame_ms = frame_ms
+        
+        held = self.held_buttons()
+        while self.accumulator >= FIXED_DT:
+            self.accumulator -= FIXED_DT
+            inputs = TickInput(held | self.pending_buttons, self.mouse_dx, self.mouse_dy)
+            self.pending_buttons = 0
+            self.mouse_dx = 0
+            self.mouse_dy = 0
+            
+            if self.recorder:
+                self.recorder.write(inputs)
+            self.sim.step(FIXED_DT, inputs)
+            if self.telemetry:
+                self.telemetry.record(self.sim)
+            self.history.record(self.sim)
+        
+        self.set_mouse_grab(not self.sim.game_over)
+    
+    # Контрольная точка: F5 пишет состояние в файл, F9 загружает, Backspace отматывает назад по кольцу
+    # Ошибка файла (нет F5 до F9, чужой или битый файл) только сообщается - игра продолжается
+    def save_checkpoint(self):
+        try:
+            write_state(self.state_path, self.sim.save_state())
+        except (OSError, struct.error) as error:
+            print(f"Контрольная точка не сохранена: {error}", file=sys.stderr)
+    
+    def load_checkpoint(self):
+        try:
+            state = load_state(self.state_path)
+        except (OSError, ValueError, struct.error) as error:
+            print(f"Контрольная точка не загружена: {error}", file=sys.stderr)
+            return
+        self.restore(state)
+        self.history.clear()
+    
+    def rewind(self):
+        state = self.history.rewind(self.sim.tick)
+        if state:
+            self.restore(state)
+    
+    # Запись ввода после подмены состояния уже не воспроизвелась бы с начала - при записи подмена запрещена
+    def restore(self, state):
+        if self.recorder:
+            return
+        self.sim.restore_state(state)
+        self.renderer.invalidate()
+    
+    def draw(self):
+        self.present(self.renderer.draw(self.sim))
+    
+    # Вывод кадра: целиком или, в режиме частичной перерисовки, только изменившиеся прямоугольники
+    def present(self, rects):
+        self.profiler.draw_overlay(self.screen)
+        with self.profiler.stage("flip"):
+            if rects is None or self.profiler.show_overlay:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+    
+    def run_frame(self):
+        self.profiler.begin_frame()
+        with self.profiler.stage("events"):
+            running = self.handle_events()
+        self.update()
+        self.draw()
+        self.profiler.end_frame()
+        return running
+    
+    def close(self):
+        self.profiler.close()
+    
+    def export_profile(self, path):
+        self.profiler.export(path)
+
+# Игра с симуляцией в отдельном потоке: кадры рисуются с любой частотой
+# по интерполированным снимкам и не задерживают тики
+class ThreadedGame(Game):
+    def __init__(self, screen, seed=None, recorder=None, profile_path=None, renderer="pygame", telemetry=None,
+                 max_fps=0, **renderer_options):
+        super().__init__(screen, seed, recorder, profile_path, renderer, telemetry, **renderer_options)
+        self.max_fps = max_fps
+        
+        # Тики профилируются отдельно от кадров: у них свой поток и своя частота
+        self.worker = SimulationThread(self.sim, FIXED_DT, recorder, telemetry, self.history)
+        self.worker.profiler = self.sim.profiler = FrameProfiler()
+        self.frame = self.worker.frame(time.perf_counter())
+        self.worker.start()
+    
+    def update(self):
+        frame_ms = self.clock.tick(self.max_fps)
+        if self.telemetry:
+            self.telemetry.frame_ms = frame_ms
+        self.worker.add_input(self.held_buttons(), self.pending_buttons, self.mouse_dx, self.mouse_dy)
+        self.pending_buttons = 0
+        self.mouse_dx = 0
+        self.mouse_dy = 0
+        
+        self.frame = self.worker.frame(time.perf_counter())
+        self.set_mouse_grab(not self.frame.game_over)
+    
+    def draw(self):
+        self.present(self.renderer.draw(self.frame))
+    
+    # Контрольные точки трогают симуляцию - выполняются в её потоке между тиками
+    def save_checkpoint(self):
+        self.worker.call(super().save_checkpoint)
+    
+    def load_checkpoint(self):
+        self.worker.call(super().load_checkpoint)
+    
+    def rewind(self):
+        self.worker.call(super().rewind)
+    
+    def close(self):
+        self.worker.stop()
+        self.worker.profiler.close()
+        super().close()
+    
+    # Профиль тиков пишется рядом: profile.csv -> profile.sim.csv
+    def export_profile(self, path):
+        super().export_profile(path)
+        stem, extension = os.path.splitext(path)
+        self.worker.profiler.export(f"{stem}.sim{extension}")
+
+# Запись ввода по тикам: заголовок и по 6 байт на тик.
+# Отбитие прицеливается по экрану, поэтому в заголовке и размер окна с углом обзора
+RECORDING_MAGIC = b"BREC"
+RECORDING_VERSION = 2
+RECORDING_HEADER = struct.Struct("<4sHIdHHd")  # магия, версия, зерно, шаг, ширина, высота, угол обзора
+RECORDING_HEADER_V1 = struct.Struct("<4sHId")  # версия 1: без экрана, записана в окне по умолчанию
+RECORDING_TICK = struct.Struct("<Hhh")
+RECORDING_DTYPE = np.dtype([("buttons", "<u2"), ("mouse_dx", "<i2"), ("mouse_dy", "<i2")])
+
+class InputRecorder:
+    def __init__(self, path, seed, dt=FIXED_DT, viewport=DEFAULT_VIEWPORT):
+        self.file = open(path, "wb")
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, seed, dt, viewport.width,
+                                              viewport.height, viewport.fov))
+    
+    def write(self, inputs):
+        mouse_dx = max(-32768, min(32767, inputs.mouse_dx))
+        mouse_dy = max(-32768, min(32767, inputs.mouse_dy))
+        self.file.write(RECORDING_TICK.pack(inputs.buttons, mouse_dx, mouse_dy))
+    
+    def close(self):
+        self.file.close()
+
+def load_recording(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, seed, dt = RECORDING_HEADER_V1.unpack_from(data)
+    if magic != RECORDING_MAGIC or version not in (1, RECORDING_VERSION):
+        raise ValueError(f"{path}: не запись ввода или неизвестная версия")
+    if version == 1:
+        viewport = DEFAULT_VIEWPORT
+        offset = RECORDING_HEADER_V1.size
+    else:
+        width, height, fov = RECORDING_HEADER.unpack_from(data)[4:]
+        viewport = Viewport(width, height, fov)
+        offset = RECORDING_HEADER.size
+    ticks = np.frombuffer(data, dtype=RECORDING_DTYPE, offset=offset)
+    return seed, dt, viewport, ticks
+
+# Воспроизведение записи без окна, быстрее реального времени, с экраном из записи
+def replay(path, profiler=None):
+    seed, dt, viewport, ticks = load_recording(path)
+    sim = Simulation(seed)
+    sim.viewport = viewport
+    if profiler:
+        sim.profiler = profiler
+    for buttons, mouse_dx, mouse_dy in ticks.tolist():
+        if profiler:
+            profiler.begin_frame()
+        sim.step(dt, TickInput(buttons, mouse_dx, mouse_dy))
+        if profiler:
+            profiler.end_frame()
+    return sim
+
+# Телеметрия сессии: заголовок и записи фиксированного размера, по одной на тик
+TELEMETRY_MAGIC = b"BTEL"
+TELEMETRY_VERSION = 1
+TELEMETRY_HEADER = struct.Struct("<4sHHI")  # магия, версия, размер записи, число записей
+TELEMETRY_COUNT = struct.Struct("<I")
+TELEMETRY_COUNT_OFFSET = TELEMETRY_HEADER.size - TELEMETRY_COUNT.size
+TELEMETRY_DTYPE = np.dtype([
+    ("tick", "<u4"),
+    ("position", "<f4", 3),
+    ("yaw", "<f4"),
+    ("pitch", "<f4"),
+    ("health", "<i2"),
+    ("enemies", "<u2"),
+    ("balls", "<u4"),
+    ("enemy_hits", "<u2"),
+    ("player_hits", "<u2"),
+    ("frame_ms", "<f4")
+])
+
+# Столько записей копится в памяти перед передачей потоку записи
+TELEMETRY_BLOCK = 256
+
+# Записей в одном файле; дальше начинается следующий
+TELEMETRY_FILE_RECORDS = 1 << 18
+
+# Если поток записи отстал на столько блоков, новые блоки отбрасываются, а не копятся
+TELEMETRY_MAX_PENDING = 64
+
+# Один файл телеметрии: буферизованная запись или отображение в память заранее выделенного файла
+class TelemetryFile:
+    def __init__(self, path, capacity, use_mmap=False):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        header = TELEMETRY_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, TELEMETRY_DTYPE.itemsize, 0)
+        if use_mmap:
+            self.file = None
+            self.map = np.memmap(path, np.uint8, "w+", shape=TELEMETRY_HEADER.size + capacity * TELEMETRY_DTYPE.itemsize)
+            self.map[:TELEMETRY_HEADER.size] = np.frombuffer(header, np.uint8)
+            self.records = self.map[TELEMETRY_HEADER.size:].view(TELEMETRY_DTYPE)
+        else:
+            self.map = None
+            self.file = open(path, "wb")
+            self.file.write(header)
+    
+    # Пишет сколько поместится и возвращает это число
+    def write(self, block):
+        block = block[:self.capacity - self.count]
+        if self.map is not None:
+            self.records[self.count:self.count + len(block)] = block
+            self.count += len(block)
+            TELEMETRY_COUNT.pack_into(self.map, TELEMETRY_COUNT_OFFSET, self.count)
+        else:
+            self.file.write(block.tobytes())
+            self.count += len(block)
+            self.file.seek(TELEMETRY_COUNT_OFFSET)
+            self.file.write(TELEMETRY_COUNT.pack(self.count))
+            self.file.seek(0, os.SEEK_END)
+        return len(block)
+    
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map = self.records = None
+            # Незаполненный хвост заранее выделенного файла не нужен
+            os.truncate(self.path, TELEMETRY_HEADER.size + self.count * TELEMETRY_DTYPE.itemsize)
+        else:
+            self.file.close()
+
+# Запись телеметрии в фоне: игровой цикл только заполняет блок в памяти, файлы пишет отдельный поток.
+# Файлы ротируются: session.btel -> session.000.btel, session.001.btel, ...
+class TelemetryWriter:
+    def __init__(self, path, use_mmap=False, file_records=TELEMETRY_FILE_RECORDS):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.file_records = file_records
+        self.block = np.zeros(TELEMETRY_BLOCK, TELEMETRY_DTYPE)
+        self.filled = 0
+        self.dropped = 0
+        self.frame_ms = 0.0
+        self.failed = False
+        
+        # Файлы прошлой, более длинной сессии по тому же пути иначе читались бы как продолжение этой
+        for name in telemetry_session_files(path):
+            os.remove(name)
+        
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+    
+    def file_path(self, index):
+        stem, extension = os.path.splitext(self.path)
+        return f"{stem}.{index:03d}{extension}"
+    
+    # Запись о только что сделанном тике; frame_ms - длительность последнего кадра
+    def record(self, sim):
+        if self.failed:
+            return
+        player = sim.player
+        self.block[self.filled] = (sim.tick, player.position.as_tuple(), player.yaw, player.pitch, player.health,
+                                   len(sim.enemies), len(sim.balls), sim.enemy_hits, sim.player_hits, self.frame_ms)
+        self.filled += 1
+        if self.filled == TELEMETRY_BLOCK:
+            self.flush()
+    
+    def flush(self):
+        if not self.filled:
+            return
+        if self.queue.qsize() < TELEMETRY_MAX_PENDING:
+            self.queue.put(self.block[:self.filled])
+            self.block = np.zeros(TELEMETRY_BLOCK, TELEMETRY_DTYPE)
+        else:
+            self.dropped += self.filled
+        self.filled = 0
+    
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+    
+    # Ошибка записи останавливает телеметрию: блоки больше не копятся, игра продолжается
+    def run(self):
+        try:
+            self.write_blocks()
+        except Exception:
+            traceback.print_exc()
+            print(f"Телеметрия {self.path} остановлена: ошибка записи", file=sys.stderr)
+            self.failed = True
+    
+    def write_blocks(self):
+        index = 0
+        current = None
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+            while len(block):
+                if current is None or current.count == current.capacity:
+                    if current:
+                        current.close()
+                    current = TelemetryFile(self.file_path(index), self.file_records, self.use_mmap)
+                    index += 1
+                block = block[current.write(block):]
+        if current:
+            current.close()
+
+# Загрузка файла телеметрии без копирования: структурный массив поверх отображения файла в память
+def load_telemetry(path):
+    with open(path, "rb") as f:
+        header = f.read(TELEMETRY_HEADER.size)
+        size = os.fstat(f.fileno()).st_size
+    magic, version, record_size, count = TELEMETRY_HEADER.unpack(header)
+    if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or record_size != TELEMETRY_DTYPE.itemsize:
+        raise ValueError(f"{path}: не файл телеметрии или неизвестная версия")
+    
+    # Файл мог остаться недописанным: берём только целые записи, которые есть на диске
+    count = min(count, (size - TELEMETRY_HEADER.size) // record_size)
+    if not count:
+        return np.zeros(0, TELEMETRY_DTYPE)
+    return np.memmap(path, TELEMETRY_DTYPE, "r", offset=TELEMETRY_HEADER.size, shape=count)
+
+# Файлы ротации на диске для пути сессии, по порядку
+def telemetry_session_files(path):
+    stem, extension = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(stem)}.[0-9][0-9][0-9]{glob.escape(extension)}"))
+
+# Все файлы сессии по порядку ротации (список массивов; np.concatenate даст один, но уже с копией)
+def load_telemetry_session(path):
+    return [load_telemetry(name) for name in telemetry_session_files(path)]
+
+# Контрольная точка на диске: заголовок, счётчики, поза игрока, генератор, баланс (JSON), затем столбцы пулов подряд
+STATE_MAGIC = b"BSTA"
+STATE_VERSION = 1
+STATE_HEADER = struct.Struct("<4sHIQIII")  # магия, версия, зерно, тик, длина баланса, число врагов, число шаров
+STATE_RNG = struct.Struct("<Id")  # версия генератора, запасное значение gauss (NaN - нет)
+STATE_RNG_WORDS = 625
+STATE_POSE = 5
+
+# Тип столбца в файле: всегда little-endian
+def state_dtype(dtype):
+    return np.dtype(dtype).newbyteorder("<")
+
+# Файл собирается в памяти и пишется рядом, затем подменяет старый: неудачное сохранение не портит прежнюю точку
+def write_state(path, state):
+    rng_version, words, gauss = state.rng
+    balance = json.dumps(state.balance._asdict()).encode()
+    parts = [
+        STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, state.seed, state.tick, len(balance), len(state.enemies),
+                          len(state.balls)),
+        state.counters.astype("<i8").tobytes(),
+        state.pose.astype("<f8").tobytes(),
+        np.array(words, "<u4").tobytes(),
+        STATE_RNG.pack(rng_version, math.nan if gauss is None else gauss),
+        balance
+    ]
+    for pool in (state.enemies, state.balls):
+        for name, (shape, dtype) in pool.columns.items():
+            parts.append(getattr(pool, name).astype(state_dtype(dtype)).tobytes())
+    
+    temporary = f"{path}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.writelines(parts)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+# Столбцы пулов в загруженном состоянии - массивы только для чтения поверх прочитанных байтов
+def load_state(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, seed, tick, balance_size, enemy_count, ball_count = STATE_HEADER.unpack_from(data)
+    if magic != STATE_MAGIC or version != STATE_VERSION:
+        raise ValueError(f"{path}: не контрольная точка или неизвестная версия")
+    
+    offset = STATE_HEADER.size
+    counters = np.frombuffer(data, "<i8", len(STATE_COUNTERS), offset)
+    offset += counters.nbytes
+    pose = np.frombuffer(data, "<f8", STATE_POSE, offset)
+    offset += pose.nbytes
+    words = np.frombuffer(data, "<u4", STATE_RNG_WORDS, offset)
+    offset += words.nbytes
+    rng_version, gauss = STATE_RNG.unpack_from(data, offset)
+    offset += STATE_RNG.size
+    rng = (rng_version, tuple(words.tolist()), None if math.isnan(gauss) else gauss)
+    balance = DEFAULT_BALANCE._replace(**json.loads(data[offset:offset + balance_size]))
+    offset += balance_size
+    
+    pools = []
+    for pool_class, count in ((EnemyPool, enemy_count), (BallPool, ball_count)):
+        pool = pool_class(0)
+        for name, (shape, dtype) in pool.columns.items():
+            array = np.frombuffer(data, state_dtype(dtype), count * math.prod(shape), offset)
+            offset += array.nbytes
+            setattr(pool, name, array.reshape((count,) + shape))
+        pool.count = count
+        pools.append(pool)
+    return SavedState(tick, seed, balance, counters, pose, rng, *pools)
+
+# Инициализация Pygame и окна
+def init_display(size=(WIDTH, HEIGHT)):
+    # Только нужные подсистемы: pygame.init() открыл бы ещё звук и джойстики; шрифты - по первому запросу
+    pygame.display.init()
+    screen = pygame.display.set_mode(size)
+    pygame.display.set_caption("Пиксельная 3D Аркада 90-х - От первого лица")
+    return screen
+
+# Безголовый прогон симуляции с фиксированным шагом
+# state - контрольная точка, с которой начинается прогон
+def run_headless(ticks, dt=FIXED_DT, fire_every=0, seed=None, profiler=None, state=None):
+    sim = Simulation(seed)
+    if state:
+        sim.restore_state(state)
+    fire = TickInput(INPUT_FIRE, 0, 0)
+    if profiler:
+        sim.profiler = profiler
+    for tick in range(ticks):
+        if profiler:
+            profiler.begin_frame()
+        sim.step(dt, fire if fire_every and tick % fire_every == 0 else IDLE_INPUT)
+        if profiler:
+            profiler.end_frame()
+        if sim.game_over:
+            break
+    return sim
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пиксельная 3D Аркада 90-х")
+    parser.add_argument("--headless", action="store_true",
+                        help="прогнать симуляцию без окна и выйти")
+    parser.add_argument("--ticks", type=int, default=3600,
+                        help="число тиков в безголовом режиме")
+    parser.add_argument("--dt", type=float, default=FIXED_DT,
+                        help="шаг симуляции в безголовом режиме (секунды)")
+    parser.add_argument("--fire-every", type=int, default=0,
+                        help="стрелять каждые N тиков в безголовом режиме")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="зерно генератора случайных чисел, 0..2^32-1")
+    parser.add_argument("--record", metavar="PATH",
+                        help="записать ввод по тикам в файл")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="воспроизвести запись ввода без окна и выйти")
+    parser.add_argument("--profile-out", metavar="PATH",
+                        help="сохранить профиль кадров (.csv или .json) при выходе; F4 сохраняет в игре")
+    parser.add_argument("--floor-extent", type=int, default=20,
+                        help="размер сетки пола в клетках от центра")
+    parser.add_argument("--renderer", choices=sorted(RENDERERS), default="pygame",
+                        help="бэкенд отрисовки: pygame.draw или программный z-буфер")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="обновлять на экране только изменившиеся области кадра")
+    parser.add_argument("--width", type=int, default=WIDTH,
+                        help="ширина окна в пикселях")
+    parser.add_argument("--height", type=int, default=HEIGHT,
+                        help="высота окна в пикселях")
+    parser.add_argument("--fov", type=float, default=DEFAULT_FOV,
+                        help="угол обзора по горизонтали в градусах")
+    parser.add_argument("--render-scale", type=float, default=1.0,
+                        help="доля разрешения окна, в которой рисуется сцена (0.5 - вдвое меньше по каждой оси)")
+    parser.add_argument("--threaded", action="store_true",
+                        help="симуляция в отдельном потоке, кадры интерполируются между тиками")
+    parser.add_argument("--max-fps", type=int, default=0,
+                        help="ограничение частоты кадров с --threaded (0 - без ограничения)")
+    parser.add_argument("--telemetry", metavar="PATH",
+                        help="писать телеметрию тиков (s.btel ротируется в s.000.btel, s.001.btel, ...)")
+    parser.add_argument("--telemetry-mmap", action="store_true",
+                        help="писать телеметрию через отображение файлов в память")
+    parser.add_argument("--state", metavar="PATH", default="state.bsta",
+                        help="файл контрольной точки: F5 сохраняет в него, F9 загружает")
+    parser.add_argument("--load-state", action="store_true",
+                        help="начать с контрольной точки из --state (в игре и безголовом режиме)")
+    parser.add_argument("--save-state", action="store_true",
+                        help="в безголовом режиме сохранить состояние в --state в конце прогона")
+    args = parser.parse_args(argv)
+    # Зерно пишется в заголовки записи и контрольной точки как беззнаковое 32-битное
+    if args.seed is not None and not 0 <= args.seed < 2**32:
+        parser.error("--seed должен быть от 0 до 2^32-1")
+    if args.width <= 0 or args.height <= 0:
+        parser.error("--width и --height должны быть больше 0")
+    if not 0 < args.fov < 180:
+        parser.error("--fov должен быть больше 0 и меньше 180 градусов")
+    if args.render_scale <= 0:
+        parser.error("--render-scale должен быть больше 0")
+    return args
 
 # Основной игровой цикл
 def main():
-    game = Game()
+    args = parse_args()
+    viewport = Viewport(args.width, args.height, args.fov, args.render_scale)
+    if args.load_state and (args.record or args.replay):
+        raise SystemExit("--load-state несовместим с --record и --replay: запись ввода идёт с начала игры")
+    
+    if args.headless or args.replay:
+        state = load_state(args.state) if args.load_state else None
+        start = time.perf_counter()
+        profiler = FrameProfiler() if args.profile_out else None
+        if args.replay:
+            sim = replay(args.replay, profiler)
+        else:
+            sim = run_headless(args.ticks, args.dt, args.fire_every, args.seed, profiler, state)
+        elapsed = time.perf_counter() - start
+        ticks = sim.tick - (state.tick if state else 0)
+        ticks_per_second = ticks / elapsed if elapsed > 0 else float("inf")
+        print(f"Тиков: {ticks}, время: {elapsed:.3f} с, {ticks_per_second:.0f} тиков/с")
+        print(f"Волна: {sim.wave}, счет: {sim.player.score}, здоровье: {sim.player.health}")
+        if profiler:
+            profiler.export(args.profile_out)
+            profiler.close()
+        if args.save_state:
+            write_state(args.state, sim.save_state())
+        return
+    
+    screen = init_display(viewport.size)
+    sim_seed = args.seed if args.seed is not None else random.randrange(2**32)
+    recorder = InputRecorder(args.record, sim_seed, viewport=viewport) if args.record else None
+    telemetry = TelemetryWriter(args.telemetry, args.telemetry_mmap) if args.telemetry else None
+    if args.threaded:
+        game = ThreadedGame(screen, sim_seed, recorder, args.profile_out, args.renderer, telemetry, args.max_fps,
+                            viewport=viewport, state_path=args.state, floor_extent=args.floor_extent,
+                            dirty_rects=args.dirty_rects)
+    else:
+        game = Game(screen, sim_seed, recorder, args.profile_out, args.renderer, telemetry, viewport, args.state,
+                    floor_extent=args.floor_extent, dirty_rects=args.dirty_rects)
+    if args.load_state:
+        game.load_checkpoint()
     
     running = True
     while running:
-        running = game.handle_events()
-        game.update()
-        game.draw()
+        running = game.run_frame()
     
+    game.close()
+    if recorder:
+        recorder.close()
+    if telemetry:
+        telemetry.close()
+    if args.profile_out:
+        game.export_profile(args.profile_out)
     pygame.quit()
     sys.exit()
 
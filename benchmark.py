@@ -0,0 +1,255 @@
+import os
+
+# Приветствие pygame не должно попадать в вывод замеров
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import functools
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pygame
+
+import balls
+
+# Размеры сцен: по столько объектов каждого вида
+SCENE_SIZES = (10, 100, 1000, 10000)
+
+# Сколько объектов остальных видов, когда масштабируется один вид
+BASE_COUNT = 10
+
+# Виды объектов сцены
+OBJECT_KINDS = ("enemies", "enemy_balls", "player_balls", "bounced_balls")
+
+# Типы шаров для видов объектов
+KIND_BALLS = {
+    "enemy_balls": balls.BALL_ENEMY,
+    "player_balls": balls.BALL_PLAYER,
+    "bounced_balls": balls.BALL_BOUNCED
+}
+
+# Холодный запуск: аргументы интерпретатора, каждый замер - новый процесс
+STARTUP_COMMANDS = {
+    "startup_import": ["-c", "import balls"],
+    "startup_headless": ["balls.py", "--headless", "--ticks", "1"],
+    "startup_first_frame": ["-c", "import balls; balls.Game(balls.init_display()).run_frame()"]
+}
+
+# Регрессией считается замедление больше этой доли от базовой линии
+DEFAULT_THRESHOLD = 0.15
+
+# ...и при этом больше этого числа миллисекунд: у замеров в десятки микросекунд шум больше порога в долях
+MIN_REGRESSION_MS = 0.1
+
+# Сценарии: имя -> число объектов каждого вида
+def make_scenarios():
+    scenarios = {}
+    for size in SCENE_SIZES:
+        scenarios[f"mixed_{size}"] = {kind: size for kind in OBJECT_KINDS}
+        for kind in OBJECT_KINDS:
+            counts = {other: BASE_COUNT for other in OBJECT_KINDS}
+            counts[kind] = size
+            scenarios[f"{kind}_{size}"] = counts
+    return scenarios
+
+def random_direction(rng):
+    z = rng.uniform(-1, 1)
+    angle = rng.uniform(0, 2 * math.pi)
+    r = math.sqrt(1 - z * z)
+    return (r * math.cos(angle), r * math.sin(angle), z)
+
+# Строим состояние игры с заданным числом объектов
+def build_scene(counts, seed=0):
+    sim = balls.Simulation(seed)
+    rng = random.Random(seed)
+    
+    # Игрок не должен погибнуть посреди замера
+    sim.player.health = 10**9
+    
+    sim.enemies = balls.EnemyPool()
+    for _ in range(counts["enemies"]):
+        dx, dy, dz = random_direction(rng)
+        distance = rng.uniform(20, 200)
+        sim.enemies.spawn((dx * distance, dy * distance * 0.2, dz * distance), sim.player.level, sim.rng)
+    
+    for kind, ball_kind in KIND_BALLS.items():
+        for _ in range(counts[kind]):
+            dx, dy, dz = random_direction(rng)
+            distance = rng.uniform(5, 200)
+            sim.balls.spawn((dx * distance, dy * distance, dz * distance), random_direction(rng), ball_kind)
+    return sim
+
+# Сцена из контрольной точки; игрок так же бессмертен
+def load_scene(path):
+    sim = balls.Simulation(0)
+    sim.restore_state(balls.load_state(path))
+    sim.player.health = 10**9
+    return sim
+
+# Число объектов каждого вида в сцене
+def scene_counts(sim):
+    counts = {"enemies": len(sim.enemies)}
+    kinds = sim.balls.kinds[:sim.balls.count]
+    for kind, ball_kind in KIND_BALLS.items():
+        counts[kind] = int(np.count_nonzero(kinds == ball_kind))
+    return counts
+
+def time_calls(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def stats(times):
+    return {
+        "median_ms": float(np.median(times)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "min_ms": float(np.min(times))
+    }
+
+# Замер одного сценария: update и draw по отдельности, каждый на свежей сцене, и снятие/возврат состояния.
+# make_scene строит сцену заново для каждой части
+def run_scenario(make_scene, repeat, surface, renderer_class=balls.Renderer, render_scale=1.0):
+    sim = make_scene()
+    sim.step(balls.FIXED_DT)  # Прогрев
+    update = time_calls(lambda: sim.step(balls.FIXED_DT), repeat)
+    
+    sim = make_scene()
+    renderer = renderer_class(surface, viewport=balls.Viewport(*surface.get_size(), render_scale=render_scale))
+    renderer.draw(sim)  # Прогрев
+    draw = time_calls(lambda: renderer.draw(sim), repeat)
+    
+    state = sim.save_state()
+    save_state = time_calls(sim.save_state, repeat)
+    restore_state = time_calls(lambda: sim.restore_state(state), repeat)
+    
+    return {"counts": scene_counts(sim), "update": stats(update), "draw": stats(draw),
+            "save_state": stats(save_state), "restore_state": stats(restore_state)}
+
+# Замер холодного запуска; без заданного видеодрайвера окно не открывается
+def run_startup(arguments, repeat):
+    env = dict(os.environ)
+    env.setdefault("SDL_VIDEODRIVER", "dummy")
+    command = [sys.executable] + arguments
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    startup = time_calls(lambda: subprocess.run(command, env=env, cwd=cwd, check=True, capture_output=True), repeat)
+    return {"startup": stats(startup)}
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "machine": platform.machine()
+    }
+
+# Сравнение с базовой линией: список замедлившихся замеров
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        for part in ("update", "draw", "save_state", "restore_state", "startup"):
+            if part not in result or part not in old:
+                continue
+            before = old[part]["median_ms"]
+            after = result[part]["median_ms"]
+            if before > 0 and after > before * (1 + threshold) and after - before > MIN_REGRESSION_MS:
+                regressions.append((name, part, before, after))
+    return regressions
+
+# Замеры сравнимы только при тех же бэкенде и масштабе отрисовки; старые базовые линии - pygame без масштаба
+def config_mismatch(args, baseline):
+    config = {"renderer": args.renderer, "render_scale": args.render_scale}
+    defaults = {"renderer": "pygame", "render_scale": 1.0}
+    return ", ".join(f"{name}: {baseline.get(name, defaults[name])} != {value}"
+                     for name, value in config.items() if baseline.get(name, defaults[name]) != value)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк update/draw для balls.py")
+    parser.add_argument("-k", "--filter", default="",
+                        help="запускать только сценарии, в имени которых есть эта строка")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="число замеров update и draw на сценарий")
+    parser.add_argument("--save", metavar="PATH",
+                        help="сохранить результаты в JSON (базовая линия)")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="сравнить с сохранённой базовой линией")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="допустимое замедление медианы (доля)")
+    parser.add_argument("--renderer", choices=sorted(balls.RENDERERS), default="pygame",
+                        help="бэкенд отрисовки для замеров draw")
+    parser.add_argument("--render-scale", type=float, default=1.0,
+                        help="доля разрешения, в которой рисуется сцена перед масштабированием")
+    parser.add_argument("--startup", action="store_true",
+                        help="замерить также холодный запуск: импорт, безголовый прогон, первый кадр")
+    parser.add_argument("--state", metavar="PATH", action="append", default=[],
+                        help="добавить сценарий из контрольной точки (state_<имя файла>); можно несколько")
+    args = parser.parse_args(argv)
+    if args.render_scale <= 0:
+        parser.error("--render-scale должен быть больше 0")
+    return args
+
+def main():
+    args = parse_args()
+    
+    # Несравнимую базовую линию отвергаем до замеров
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatch = config_mismatch(args, baseline)
+        if mismatch:
+            print(f"Базовая линия снята с другими настройками ({mismatch}), сравнение невозможно", file=sys.stderr)
+            sys.exit(2)
+    
+    # Рисуем в поверхность в памяти, окно не нужно
+    pygame.font.init()
+    surface = pygame.Surface((balls.WIDTH, balls.HEIGHT), depth=32)
+    
+    results = {}
+    if args.startup:
+        for name, arguments in STARTUP_COMMANDS.items():
+            if args.filter not in name:
+                continue
+            result = results[name] = run_startup(arguments, args.repeat)
+            print(f"{name:>20}  startup {result['startup']['median_ms']:9.3f} ms", flush=True)
+    
+    scenes = {name: functools.partial(build_scene, counts) for name, counts in make_scenarios().items()}
+    for path in args.state:
+        name = os.path.splitext(os.path.basename(path))[0]
+        scenes[f"state_{name}"] = functools.partial(load_scene, path)
+    
+    for name, make_scene in scenes.items():
+        if args.filter not in name:
+            continue
+        result = results[name] = run_scenario(make_scene, args.repeat, surface, balls.RENDERERS[args.renderer],
+                                              args.render_scale)
+        print(f"{name:>20}  update {result['update']['median_ms']:9.3f} ms  "
+              f"draw {result['draw']['median_ms']:9.3f} ms  "
+              f"state {result['save_state']['median_ms']:6.3f}/{result['restore_state']['median_ms']:6.3f} ms",
+              flush=True)
+    
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment(), "renderer": args.renderer, "render_scale": args.render_scale, "repeat": args.repeat, "results": results}, f, indent=1)
+    
+    if args.baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name, part, before, after in regressions:
+            print(f"РЕГРЕССИЯ {name} {part}: {before:.3f} -> {after:.3f} ms ({after / before - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print("Регрессий нет")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file